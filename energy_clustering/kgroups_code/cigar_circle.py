@@ -36,7 +36,7 @@ for _ in range(num_experiments):
     #G = eclust.kernel_matrix(X, 
     #        lambda x, y: 2 - 2*np.exp(-np.linalg.norm(x-y)/2/2))
     G = eclust.kernel_matrix(X, 
-            lambda x, y: 2 - 2*np.exp(-np.linalg.norm(x-y)**2/2/1))
+            eclust.Semimetric('gauss', 1))
     
     row = []
     zh = wrapper.kmeans(k, X)
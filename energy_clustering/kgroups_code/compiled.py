@@ -0,0 +1,329 @@
+"""Compiled sweeps for the optimizers in eclust, using numba.
+
+The functions mirror the Python sweeps of the same name in eclust (such as
+eclust._kgroups_sweep) operation by operation, so they return the same
+labels. Importing this module raises ImportError when numba is not
+available, in which case eclust uses the pure Python sweeps.
+
+"""
+
+# Guilherme Franca <guifranca@gmail.com>
+# Johns Hopkins University
+
+from __future__ import division
+
+import numpy as np
+import numba
+
+
+@numba.njit(error_model='numpy', cache=True)
+def kgroups_sweep(z, QZ, Gtilde, g, w, s, q, start=0):
+    """One pass of kernel k-groups over the points of the rows Gtilde."""
+    n, k = QZ.shape
+    n_changed = 0
+    n_skipped = 0
+    for i in range(start, start+Gtilde.shape[0]):
+        
+        j = z[i]
+        if s[j] <= 1:
+            n_skipped += 1
+            continue
+        
+        Aj = (1.0/(s[j]-w[i]))*(w[i]*q[j]/s[j] - 2*QZ[i,j] + g[i])
+        
+        # same choice as np.argmax, where a nan is taken as the maximum
+        j_star = j
+        best = -np.inf
+        for l in range(k):
+            if l == j:
+                continue
+            Al = (1.0/(s[l]+w[i]))*(w[i]*q[l]/s[l] - 2*QZ[i,l] - g[i])
+            delta = Aj - Al
+            if np.isnan(delta):
+                j_star = l
+                best = delta
+                break
+            if delta > best:
+                j_star = l
+                best = delta
+        
+        if best > 0:
+            z[i] = j_star
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            q[j] = q[j] - 2*QZ[i,j] + g[i]
+            q[j_star] = q[j_star] + 2*QZ[i,j_star] + g[i]
+            for m in range(n):
+                QZ[m,j] -= Gtilde[i-start,m]
+                QZ[m,j_star] += Gtilde[i-start,m]
+            n_changed += 1
+    return n_changed, n_skipped
+
+@numba.njit(error_model='numpy', cache=True)
+def kmeans_sweep(z, QZ, Gtilde, g, w, s, q, start=0):
+    """One pass of kernel k-means over the points of the rows Gtilde."""
+    n, k = QZ.shape
+    n_changed = 0
+    for i in range(start, start+Gtilde.shape[0]):
+        
+        j = z[i]
+        
+        # same choice as np.argmin, where a nan is taken as the minimum
+        j_star = 0
+        best = np.inf
+        for l in range(k):
+            cost = q[l]/(s[l]*s[l]) - 2*QZ[i,l]/s[l]
+            if np.isnan(cost):
+                j_star = l
+                break
+            if cost < best:
+                j_star = l
+                best = cost
+        
+        if j_star != j:
+            z[i] = j_star
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            q[j] = q[j] - 2*QZ[i,j] + g[i]
+            q[j_star] = q[j_star] + 2*QZ[i,j_star] + g[i]
+            for m in range(n):
+                QZ[m,j] -= Gtilde[i-start,m]
+                QZ[m,j_star] += Gtilde[i-start,m]
+            n_changed += 1
+    return n_changed, 0
+
+@numba.njit(error_model='numpy', cache=True)
+def kgroups_lowrank_sweep(z, S, F, g, w, s, q, start=0):
+    """One pass of kernel k-groups with a low rank kernel G = F F^T."""
+    n, r = F.shape
+    k = S.shape[0]
+    Q_xi = np.empty(k)
+    n_changed = 0
+    n_skipped = 0
+    for i in range(start, start+n):
+        
+        j = z[i]
+        if s[j] <= 1:
+            n_skipped += 1
+            continue
+        
+        for l in range(k):
+            acc = 0.0
+            for m in range(r):
+                acc += S[l,m]*F[i-start,m]
+            Q_xi[l] = acc
+        Aj = (1.0/(s[j]-w[i]))*(w[i]*q[j]/s[j] - 2*Q_xi[j] + g[i])
+        
+        # same choice as np.argmax, where a nan is taken as the maximum
+        j_star = j
+        best = -np.inf
+        for l in range(k):
+            if l == j:
+                continue
+            Al = (1.0/(s[l]+w[i]))*(w[i]*q[l]/s[l] - 2*Q_xi[l] - g[i])
+            delta = Aj - Al
+            if np.isnan(delta):
+                j_star = l
+                best = delta
+                break
+            if delta > best:
+                j_star = l
+                best = delta
+        
+        if best > 0:
+            z[i] = j_star
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            q[j] = q[j] - 2*Q_xi[j] + g[i]
+            q[j_star] = q[j_star] + 2*Q_xi[j_star] + g[i]
+            for m in range(r):
+                S[j,m] -= F[i-start,m]
+                S[j_star,m] += F[i-start,m]
+            n_changed += 1
+    return n_changed, n_skipped
+
+@numba.njit(error_model='numpy', cache=True)
+def kmeans_lowrank_sweep(z, S, F, g, w, s, q, start=0):
+    """One pass of kernel k-means with a low rank kernel G = F F^T."""
+    n, r = F.shape
+    k = S.shape[0]
+    Q_xi = np.empty(k)
+    n_changed = 0
+    for i in range(start, start+n):
+        
+        j = z[i]
+        for l in range(k):
+            acc = 0.0
+            for m in range(r):
+                acc += S[l,m]*F[i-start,m]
+            Q_xi[l] = acc
+        
+        # same choice as np.argmin, where a nan is taken as the minimum
+        j_star = 0
+        best = np.inf
+        for l in range(k):
+            cost = q[l]/(s[l]*s[l]) - 2*Q_xi[l]/s[l]
+            if np.isnan(cost):
+                j_star = l
+                break
+            if cost < best:
+                j_star = l
+                best = cost
+        
+        if j_star != j:
+            z[i] = j_star
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            q[j] = q[j] - 2*Q_xi[j] + g[i]
+            q[j_star] = q[j_star] + 2*Q_xi[j_star] + g[i]
+            for m in range(r):
+                S[j,m] -= F[i-start,m]
+                S[j_star,m] += F[i-start,m]
+            n_changed += 1
+    return n_changed, 0
+
+@numba.njit(error_model='numpy', cache=True)
+def kgroups_centroid_sweep(z, M, Phi, pn, w, s, mn):
+    """One pass of kernel k-groups with explicit centroids."""
+    n, r = Phi.shape
+    k = M.shape[0]
+    d = np.empty(k)
+    n_changed = 0
+    n_skipped = 0
+    for i in range(n):
+        
+        j = z[i]
+        if s[j] <= 1:
+            n_skipped += 1
+            continue
+        
+        for l in range(k):
+            acc = 0.0
+            for m in range(r):
+                acc += M[l,m]*Phi[i,m]
+            d[l] = pn[i] - 2*acc + mn[l]
+        Aj = w[i]*s[j]/(s[j]-w[i])*d[j]
+        
+        # same choice as np.argmax, where a nan is taken as the maximum
+        j_star = j
+        best = -np.inf
+        for l in range(k):
+            if l == j:
+                continue
+            delta = Aj - w[i]*s[l]/(s[l]+w[i])*d[l]
+            if np.isnan(delta):
+                j_star = l
+                best = delta
+                break
+            if delta > best:
+                j_star = l
+                best = delta
+        
+        if best > 0:
+            z[i] = j_star
+            mj = 0.0
+            ml = 0.0
+            for m in range(r):
+                M[j,m] = (s[j]*M[j,m] - w[i]*Phi[i,m])/(s[j]-w[i])
+                M[j_star,m] = (s[j_star]*M[j_star,m] + w[i]*Phi[i,m])/ \
+                                                        (s[j_star]+w[i])
+                mj += M[j,m]*M[j,m]
+                ml += M[j_star,m]*M[j_star,m]
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            mn[j] = mj
+            mn[j_star] = ml
+            n_changed += 1
+    return n_changed, n_skipped
+
+@numba.njit(error_model='numpy', cache=True)
+def kgroups_sparse_sweep(z, QB, indptr, indices, data, u, v, U, V,
+                         g, w, s, q):
+    """One pass of kernel k-groups with a sparse kernel."""
+    n, k = QB.shape
+    Q_xi = np.empty(k)
+    n_changed = 0
+    n_skipped = 0
+    for i in range(n):
+        
+        j = z[i]
+        if s[j] <= 1:
+            n_skipped += 1
+            continue
+        
+        for l in range(k):
+            Q_xi[l] = QB[i,l] + u[i]*V[l] + v[i]*U[l]
+        Aj = (1.0/(s[j]-w[i]))*(w[i]*q[j]/s[j] - 2*Q_xi[j] + g[i])
+        
+        # same choice as np.argmax, where a nan is taken as the maximum
+        j_star = j
+        best = -np.inf
+        for l in range(k):
+            if l == j:
+                continue
+            Al = (1.0/(s[l]+w[i]))*(w[i]*q[l]/s[l] - 2*Q_xi[l] - g[i])
+            delta = Aj - Al
+            if np.isnan(delta):
+                j_star = l
+                best = delta
+                break
+            if delta > best:
+                j_star = l
+                best = delta
+        
+        if best > 0:
+            z[i] = j_star
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            q[j] = q[j] - 2*Q_xi[j] + g[i]
+            q[j_star] = q[j_star] + 2*Q_xi[j_star] + g[i]
+            for p in range(indptr[i], indptr[i+1]):
+                QB[indices[p],j] -= data[p]
+                QB[indices[p],j_star] += data[p]
+            U[j] -= u[i]
+            U[j_star] += u[i]
+            V[j] -= v[i]
+            V[j_star] += v[i]
+            n_changed += 1
+    return n_changed, n_skipped
+
+@numba.njit(error_model='numpy', cache=True)
+def kmeans_sparse_sweep(z, QB, indptr, indices, data, u, v, U, V,
+                        g, w, s, q):
+    """One pass of kernel k-means with a sparse kernel."""
+    n, k = QB.shape
+    Q_xi = np.empty(k)
+    n_changed = 0
+    for i in range(n):
+        
+        j = z[i]
+        for l in range(k):
+            Q_xi[l] = QB[i,l] + u[i]*V[l] + v[i]*U[l]
+        
+        # same choice as np.argmin, where a nan is taken as the minimum
+        j_star = 0
+        best = np.inf
+        for l in range(k):
+            cost = q[l]/(s[l]*s[l]) - 2*Q_xi[l]/s[l]
+            if np.isnan(cost):
+                j_star = l
+                break
+            if cost < best:
+                j_star = l
+                best = cost
+        
+        if j_star != j:
+            z[i] = j_star
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            q[j] = q[j] - 2*Q_xi[j] + g[i]
+            q[j_star] = q[j_star] + 2*Q_xi[j_star] + g[i]
+            for p in range(indptr[i], indptr[i+1]):
+                QB[indices[p],j] -= data[p]
+                QB[indices[p],j_star] += data[p]
+            U[j] -= u[i]
+            U[j_star] += u[i]
+            V[j] -= v[i]
+            V[j_star] += v[i]
+            n_changed += 1
+    return n_changed, 0
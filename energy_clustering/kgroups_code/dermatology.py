@@ -21,10 +21,10 @@ import metric
 
 
 # some semmimetric functions
-rho = lambda x, y: np.power(np.linalg.norm(x-y), 0.5)
-rho1 = lambda x, y: np.linalg.norm(x-y)
-rho_gauss = lambda x, y: 2-2*np.exp(-np.linalg.norm(x-y)**2/(2*(3.5)**2))
-rho_exp = lambda x, y: 2-2*np.exp(-np.linalg.norm(x-y)/(2*3.7))
+rho = eclust.Semimetric('power', 0.5)
+rho1 = eclust.Semimetric('power', 1)
+rho_gauss = eclust.Semimetric('gauss', 3.5)
+rho_exp = eclust.Semimetric('exp', 3.7)
 
 
 # get dermatology data, last column are labels
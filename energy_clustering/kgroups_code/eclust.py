@@ -6,35 +6,202 @@
 
 from __future__ import division
 
+import multiprocessing as mp
+from timeit import default_timer as timer
+
 import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, cg
+from scipy.spatial.distance import pdist, cdist, squareform
 from sklearn.metrics.pairwise import pairwise_distances
+from sklearn.neighbors import NearestNeighbors
+
+try:
+    import compiled
+except ImportError: # numba is not installed
+    compiled = None
 
-def ztoZ(z):
-    """Convert label vector to label matrix."""
-    n = z.shape[0]
-    k = np.unique(z).shape[0]
-    Z = np.zeros((n,k))
-    for i in range(n):
-        Z[i, int(z[i])] = 1
-    return Z
+# size in bytes of the blocks of rows read from a memory mapped kernel
+TILE_BYTES = 2**27
+
+def ztoZ(z, k=None, sparse=False):
+    """Convert label vector to label matrix. If sparse is True return it as
+    a scipy.sparse CSR matrix.
+    
+    """
+    z = np.asarray(z, dtype=int)
+    if k is None:
+        k = np.unique(z).shape[0]
+    Z = _onehot(z, k)
+    if sparse:
+        return Z
+    return Z.toarray()
 
 def Ztoz(Z):
     """Convert label matrix to label vector."""
     n, k = Z.shape
     z = np.zeros(n)
     points, labels = np.where(Z==1)
-    for i in range(len(points)):
-        z[points[i]] = labels[i]
+    z[points] = labels
     return z
 
-def objective(Z, G, W):
-    """Compute objective function."""
-    W_half = np.sqrt(W)
-    W_half_Z = W_half.dot(Z) # This is the same as Z with 1 -> w_i^{1/2} 
-    Sum_weights = W_half_Z.T.dot(W_half_Z) # diagonal matrix with s_i 
-    Y = Z.dot(np.linalg.inv(np.sqrt(Sum_weights)))
-    G_tilde = W.dot(G.dot(W))
-    return np.trace(Y.T.dot(G_tilde.dot(Y)))
+def _onehot(z, k, w=None):
+    """Sparse n x k matrix with w_i (or 1) at entry (i, z_i)."""
+    n = len(z)
+    if w is None:
+        w = np.ones(n)
+    return sparse.csr_matrix((w, (np.arange(n), z)), shape=(n, k))
+
+def _labels(z0, k=None):
+    """Return labels as an int32 vector and the number of clusters. z0 can be
+    either a label vector or an n x k label matrix.
+    
+    """
+    z0 = np.asarray(z0)
+    if z0.ndim == 2:
+        return np.argmax(z0, axis=1).astype(np.int32), z0.shape[1]
+    z = z0.astype(np.int32)
+    if k is None:
+        k = z.max() + 1
+    return z, k
+
+def weights(W, n):
+    """Return the point weights as a vector of length n. W can be None
+    (unit weights), a vector of weights, or, for compatibility, the
+    diagonal n x n weight matrix.
+    
+    """
+    if W is None:
+        return np.ones(n)
+    W = np.asarray(W, dtype=float)
+    if W.ndim == 2:
+        return np.diag(W).copy()
+    return W
+
+def weighted_kernel(G, w):
+    """Return Gtilde = diag(w) G diag(w) by broadcasting, with the dtype
+    of G. G itself is returned when all weights are one.
+    
+    """
+    if isinstance(G, (LowRankKernel, SparseKernel)):
+        return G.weighted(w)
+    if np.all(w == 1):
+        return G
+    if G.dtype == np.float32:
+        w = w.astype(np.float32)
+    Gtilde = G*w[np.newaxis,:]
+    Gtilde *= w[:,np.newaxis]
+    return Gtilde
+
+def objective(z, G, W=None):
+    """Compute objective function sum_l q_l/s_l in O(n^2), or O(nr) for a
+    ``LowRankKernel`` of rank r, without forming the weighted kernel. z is
+    either a label vector or a label matrix, W the weights as accepted by
+    ``weights``.
+    
+    """
+    return objective_stats(*cluster_stats(z, G, W))
+
+def cluster_stats(z, G, W=None, k=None):
+    """Return the costs q_l = sum_{i,j in C_l} w_i w_j G_ij and the sums of
+    weights s_l of each cluster. Input as in ``objective``, and k is the
+    number of clusters if some of the last ones are empty.
+    
+    """
+    z, k = _labels(z, k)
+    n = G.shape[0]
+    w = weights(W, n)
+    s = np.bincount(z, weights=w, minlength=k)
+    Zw = _onehot(z, k, w)
+    if isinstance(G, LowRankKernel):
+        # q_l is the squared norm of the weighted sum of the factor rows
+        S = np.asarray(Zw.T.dot(G.Phi))
+        return (S**2).sum(axis=1), s
+    if isinstance(G, SparseKernel):
+        q = np.asarray(Zw.T.dot(G.B.dot(Zw)).diagonal()).ravel()
+        q += 2*Zw.T.dot(G.u)*Zw.T.dot(G.v)
+        return q, s
+    # row l of Zw^T G is the affinity of every point with cluster l
+    q = np.zeros(k)
+    for start, rows in _row_tiles(G):
+        QZ = np.asarray(Zw.T.dot(rows.T))
+        i = np.arange(start, start+len(rows))
+        q += np.bincount(z[i], weights=w[i]*QZ[z[i], i-start], minlength=k)
+    return q, s
+
+def objective_stats(q, s):
+    """Compute objective function in O(k) from the costs q_l and sum of
+    weights s_l of each cluster. Empty clusters do not contribute.
+    
+    """
+    q = np.asarray(q, dtype=float)
+    s = np.asarray(s, dtype=float)
+    nonempty = s > 0
+    return (q[nonempty]/s[nonempty]).sum()
+
+class Semimetric(object):
+    """Semimetrics of the form rho(x,y) = f(||x-y||) used in the experiments.
+    
+    kind='power':  rho(x,y) = ||x-y||^param
+    kind='exp':    rho(x,y) = 2 - 2 exp(-||x-y||/(2 param))
+    kind='gauss':  rho(x,y) = 2 - 2 exp(-||x-y||^2/(2 param^2))
+
+    An instance can be used as rho(x, y) like any other semimetric, but
+    ``kernel_matrix`` recognizes it and builds G with whole matrix operations
+    instead of calling rho on every pair.
+    
+    """
+
+    kinds = ('power', 'exp', 'gauss')
+
+    def __init__(self, kind='power', param=1):
+        if kind not in self.kinds:
+            raise ValueError("Unknown semimetric '%s'." % kind)
+        self.kind = kind
+        self.param = param
+
+    def _apply(self, D):
+        """Map distances D (squared for 'gauss') to rho, in place."""
+        if self.kind == 'power':
+            if self.param != 1:
+                np.power(D, self.param, out=D)
+        elif self.kind == 'exp':
+            D *= -1.0/(2*self.param)
+            np.exp(D, out=D)
+            D *= -2
+            D += 2
+        else:
+            D *= -1.0/(2*self.param**2)
+            np.exp(D, out=D)
+            D *= -2
+            D += 2
+        return D
+
+    def pairwise(self, X, Y=None):
+        """Matrix with rho between rows of X and Y. If Y is None only the
+        upper triangle of rho(X, X) is evaluated.
+        
+        """
+        metric = 'sqeuclidean' if self.kind == 'gauss' else 'euclidean'
+        if Y is None:
+            return squareform(self._apply(pdist(X, metric)))
+        return self._apply(cdist(X, Y, metric))
+
+    def paired(self, X, Y):
+        """Vector with rho between corresponding rows of X and Y."""
+        D = ((X - Y)**2).sum(axis=1)
+        if self.kind != 'gauss':
+            np.sqrt(D, out=D)
+        return self._apply(D)
+
+    def __call__(self, x, y):
+        d = np.linalg.norm(np.asarray(x, dtype=float) - y)
+        if self.kind == 'gauss':
+            d = d**2
+        return self._apply(np.array([d]))[0]
+
+    def __repr__(self):
+        return "Semimetric(%r, %r)" % (self.kind, self.param)
 
 def kernel_function(x, y, rho, x0=None):
     """Return kernel function based on rho."""
@@ -43,131 +210,855 @@ def kernel_function(x, y, rho, x0=None):
     val = 0.5*(rho(x,x0) + rho(y,x0) - rho(x,y))
     return val
 
-def kernel_matrix(X, rho, x0=None):
-    """Compute Kernel matrix based on kernel function K(x,y)."""
+def kernel_matrix(X, rho, x0=None, Y=None, dtype=np.float64):
+    """Compute Kernel matrix based on kernel function K(x,y).
+    
+    If rho is a ``Semimetric`` the matrix 0.5*(rho(x,x0)+rho(y,x0)-rho(x,y))
+    is computed with vectorized operations, using only the upper triangle of
+    rho(X, X). Any other callable goes through ``kernel_function`` pairwise.
+    If Y is given return the cross kernel between the rows of X and Y.
+
+    The matrix is returned as dtype. With np.float32 it takes half the
+    memory, and with a ``Semimetric`` it is filled in float64 tiles so no
+    n x n float64 matrix is allocated. The optimizers, ``objective`` and
+    the initializers keep a float32 G as it is, and accumulate in float64.
+
+    """
+    if isinstance(rho, Semimetric):
+        X = np.asarray(X, dtype=float)
+        if type(x0) == type(None):
+            x0 = np.zeros(X.shape[1])
+        x0 = np.asarray(x0, dtype=float).reshape(1, -1)
+        if Y is None and dtype != np.float64:
+            n = X.shape[0]
+            G = np.empty((n, n), dtype=dtype)
+            for I, J in _tiles(n, 2048):
+                _fill_tile(G, X, rho, x0, I, J)
+            return G
+        r0 = rho.pairwise(X, x0)
+        if Y is None:
+            G = rho.pairwise(X)
+            r0Y = r0
+        else:
+            Y = np.asarray(Y, dtype=float)
+            G = rho.pairwise(X, Y)
+            r0Y = rho.pairwise(Y, x0)
+        G *= -0.5
+        G += 0.5*r0
+        G += 0.5*r0Y.T
+        return G.astype(dtype, copy=False)
     kfunc = lambda x, y: kernel_function(x, y, rho, x0)
     #G = pairwise_distances(X, metric=kfunc, n_jobs=4)
-    G = pairwise_distances(X, metric=kfunc)
-    return G
+    G = pairwise_distances(X, Y, metric=kfunc)
+    return G.astype(dtype, copy=False)
 
-def kernel_kgroups(k, G, Z0, W, max_iter=100, tol=1e-4, verbose=False,
-                   return_Z=False):
-    """Optimize the W objective function by considering moving points
-    to different partitions. Compute the change in the cost function by
-    moving a point then decide the best partition to optimize the cost
-    function. 
+def _tiles(n, tile):
+    """Pairs of row and column ranges of the tiles on and above the
+    diagonal of an n x n matrix."""
+    bounds = [(a, min(a+tile, n)) for a in range(0, n, tile)]
+    return [(bounds[i], bounds[j]) for i in range(len(bounds))
+                                   for j in range(i, len(bounds))]
+
+def _fill_tile(G, X, rho, x0, I, J):
+    """Compute tile (I, J) of the kernel matrix and write it, and its
+    transpose, to G."""
+    a, b = I
+    c, d = J
+    if a == c:
+        G[a:b,a:b] = kernel_matrix(X[a:b], rho, x0)
+    else:
+        T = kernel_matrix(X[a:b], rho, x0, Y=X[c:d])
+        G[a:b,c:d] = T
+        G[c:d,a:b] = T.T
+
+# data shared with the worker processes, set by _init_tile_worker
+_shared = {}
+
+def _init_tile_worker(X, rho, x0):
+    _shared['X'] = X
+    _shared['rho'] = rho
+    _shared['x0'] = x0
+
+def _kernel_tile(args):
+    """Compute a tile of the kernel matrix into the memory mapped file."""
+    filename, I, J = args
+    G = np.load(filename, mmap_mode='r+')
+    _fill_tile(G, _shared['X'], _shared['rho'], _shared['x0'], I, J)
+    G.flush()
+    del G
+
+def kernel_matrix_memmap(X, rho, filename, x0=None, dtype=np.float64,
+                         tile=2048, n_jobs=1):
+    """Compute the kernel matrix of ``kernel_matrix`` out of core, in tiles
+    of tile x tile entries written to the .npy file filename as the given
+    dtype. Only the tiles on and above the diagonal are computed, and each
+    one is mirrored below it. With n_jobs > 1 the tiles are computed by a
+    process pool, each worker writing to the file directly. X, rho and x0
+    are handed to the workers once, when the pool starts, and each task
+    only names its tile; rho must be picklable (e.g. a ``Semimetric``, not
+    a lambda).
+
+    Return G memory mapped read only. The optimizers, ``objective`` and the
+    initializers in ``init`` read it in blocks of rows, in file order.
+
+    """
+    n = X.shape[0]
+    G = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                  shape=(n, n))
+    del G
+    tasks = [(filename, I, J) for I, J in _tiles(n, tile)]
+    if n_jobs == 1:
+        _init_tile_worker(X, rho, x0)
+        try:
+            for t in tasks:
+                _kernel_tile(t)
+        finally:
+            _shared.clear()
+    else:
+        pool = mp.Pool(n_jobs, initializer=_init_tile_worker,
+                       initargs=(X, rho, x0))
+        try:
+            pool.map(_kernel_tile, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    return np.load(filename, mmap_mode='r')
+
+def kernel_matrix_knn(X, rho, m, x0=None, algorithm='kd_tree',
+                      n_samples=None):
+    """Sparse approximation of kernel_matrix(X, rho, x0) which keeps rho
+    exactly only between each point and its m nearest neighbors (in the
+    Euclidean distance), found with a KD-tree or a ball tree (algorithm is
+    passed to sklearn's NearestNeighbors). Between any other pair rho(x,y)
+    is replaced by the additive approximation a_x + a_y, with a chosen so
+    that every row of rho keeps its sum, so the kernel mass of far away
+    points is kept instead of dropped. The row sums are computed exactly,
+    in blocks of rows, which takes O(n^2) time but O(n) memory. Passing
+    n_samples instead estimates them from that many random points, in
+    O(n n_samples), at the price of sampling noise in a and so in u.
+
+    The result is a ``SparseKernel`` G = B + u 1^T + 1 u^T, with B sparse
+    (O(nm) entries) and u = (r0 - a)/2, where r0 = rho(x, x0). The terms
+    u 1^T + 1 u^T are kept exactly, and the diagonal of G is exactly r0.
+
+    """
+    X = np.asarray(X, dtype=float)
+    n = X.shape[0]
+    if type(x0) == type(None):
+        x0 = np.zeros(X.shape[1])
+    x0 = np.asarray(x0, dtype=float).reshape(1, -1)
+    if isinstance(rho, Semimetric):
+        paired = rho.paired
+        cross = rho.pairwise
+    else:
+        paired = lambda A, B: np.array([rho(a, b) for a, b in zip(A, B)])
+        cross = lambda A, B: pairwise_distances(A, B, metric=rho)
+    
+    nn = NearestNeighbors(n_neighbors=m, algorithm=algorithm).fit(X)
+    A = nn.kneighbors_graph(mode='connectivity') # without the point itself
+    P = (A + A.T + sparse.eye(n)).tocoo() # symmetric pattern
+    P.sum_duplicates()
+    row, col = P.row, P.col
+    rho_P = paired(X[row], X[col])
+    
+    # row sums of rho
+    S = X if n_samples is None or n_samples >= n else \
+        X[np.random.choice(n, n_samples, replace=False)]
+    step = max(1, TILE_BYTES//(8*len(S)))
+    R = n*np.concatenate([cross(X[i:i+step], S).mean(axis=1)
+                          for i in range(0, n, step)])
+    
+    # a_i + a_j outside the pattern and rho inside it have row sums R,
+    # i.e. (n - deg_i) a_i + sum_{j not in P_i} a_j = R_i - sum_{P_i} rho
+    deg = np.bincount(row, minlength=n)
+    P = sparse.csr_matrix((np.ones(len(row)), (row, col)), shape=(n, n))
+    M = LinearOperator((n, n), dtype=float,
+                       matvec=lambda x: (n-deg)*x + x.sum() - P.dot(x))
+    b = R - np.bincount(row, weights=rho_P, minlength=n)
+    a, _ = cg(M, b, x0=R/n - R.mean()/(2*n))
+    
+    E = rho_P - a[row] - a[col]
+    B = sparse.csr_matrix((-0.5*E, (row, col)), shape=(n, n))
+    return SparseKernel(B, 0.5*(cross(X, x0).ravel() - a))
+
+class SparseKernel(object):
+    """Kernel matrix G = B + u v^T + v u^T, with B a sparse symmetric matrix
+    and v = 1 unless given, as built by ``kernel_matrix_knn``. Like
+    ``LowRankKernel`` it can be passed in place of G; the optimizers update
+    the affinities with sparse rows of B and keep cluster sums of u and v,
+    so a sweep costs O(n(m+k)) with m the number of nonzeros per row.
+
+    """
+
+    def __init__(self, B, u, v=None):
+        self.B = sparse.csr_matrix(B, dtype=np.float64)
+        self.u = np.asarray(u, dtype=np.float64)
+        n = self.B.shape[0]
+        self.v = np.ones(n) if v is None else np.asarray(v, dtype=np.float64)
+        self.shape = (n, n)
+        self.dtype = np.dtype(np.float64)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, i):
+        """Row i of G, or the rows with indices i."""
+        rows = self.B[i].toarray()
+        if np.ndim(i) == 0:
+            rows = rows[0]
+        return rows + np.multiply.outer(self.u[i], self.v) + \
+                      np.multiply.outer(self.v[i], self.u)
+
+    def diagonal(self):
+        return self.B.diagonal() + 2*self.u*self.v
+
+    def dot(self, M):
+        return self.B.dot(M) + np.multiply.outer(self.u, self.v.dot(M)) + \
+                               np.multiply.outer(self.v, self.u.dot(M))
+
+    def weighted(self, w):
+        """diag(w) G diag(w), which is again of this form."""
+        if np.all(w == 1):
+            return self
+        B = self.B.multiply(w[:,np.newaxis]).multiply(w[np.newaxis,:])
+        return SparseKernel(B, w*self.u, w*self.v)
+
+    def toarray(self):
+        return self.B.toarray() + np.outer(self.u, self.v) + \
+                                  np.outer(self.v, self.u)
+
+class LowRankKernel(object):
+    """Kernel matrix G = Phi Phi^T kept as its n x r factor Phi, such as the
+    one given by ``nystrom.nystrom``. It provides the operations used by the
+    optimizers and by ``init`` (shape, rows, diagonal and products), so it
+    can be passed in place of G without forming the n x n matrix.
     
+    """
+
+    def __init__(self, Phi):
+        self.Phi = np.ascontiguousarray(Phi, dtype=np.float64)
+        n = self.Phi.shape[0]
+        self.shape = (n, n)
+        self.dtype = self.Phi.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, i):
+        """Row i of G, or the rows with indices i."""
+        return self.Phi[i].dot(self.Phi.T)
+
+    def diagonal(self):
+        return np.einsum('ij,ij->i', self.Phi, self.Phi)
+
+    def dot(self, M):
+        return self.Phi.dot(self.Phi.T.dot(M))
+
+    def weighted(self, w):
+        """Factor of diag(w) G diag(w)."""
+        if np.all(w == 1):
+            return self
+        return LowRankKernel(w[:,np.newaxis]*self.Phi)
+
+    def toarray(self):
+        return self.Phi.dot(self.Phi.T)
+
+def _row_tiles(G, w=None):
+    """Yield (start, rows) with blocks of rows of Gtilde = diag(w) G diag(w)
+    (of G if w is None) as float64, about TILE_BYTES at a time, so that a
+    memory mapped G is read from disk in file order and a float32 G is
+    never converted whole. An in-memory float64 G is yielded whole.
+
     """
     n = G.shape[0]
-    Z = np.copy(Z0)
-    Zt = Z.T
-    Gtilde = W.dot(G.dot(W)) # absorb weights into a new matrix
-    Q_matrix = Zt.dot(Gtilde.dot(Z))  
-    w = W.dot(np.ones(n)) # vector containing weights
-    s = list(Zt.dot(w)) # vector of s_i's, sum of weights in each cluster
-    q = list(np.diag(Q_matrix)) # vector with costs of each cluster
+    if not isinstance(G, np.memmap) and G.dtype == np.float64:
+        yield 0, G if w is None else weighted_kernel(G, w)
+        return
+    step = max(1, TILE_BYTES//(8*n))
+    for start in range(0, n, step):
+        rows = np.array(G[start:start+step], dtype=np.float64)
+        if w is not None:
+            rows *= w[np.newaxis,:]
+            rows *= w[start:start+step,np.newaxis]
+        yield start, rows
+
+def kernel_dot(G, M):
+    """Product G M in float64, reading a memory mapped or float32 G in
+    blocks of rows."""
+    if not isinstance(G, np.memmap) and G.dtype == np.float64:
+        return G.dot(M)
+    out = np.empty((G.shape[0],) + M.shape[1:])
+    for start, rows in _row_tiles(G):
+        out[start:start+len(rows)] = rows.dot(M)
+    return out
+
+def _kgroups_sweep(z, QZ, Gtilde, g, w, s, q, start=0):
+    """One pass of kernel k-groups over the points whose rows of Gtilde are
+    given, i.e. points start to start+len(Gtilde)-1. Return the number of
+    points that changed cluster and the number of points skipped because
+    their cluster is too small to be left.
+
+    """
+    n_changed = 0
+    n_skipped = 0
+    for i in range(start, start+len(Gtilde)): # for each data point
     
-    count = 0
-    converged = False
-    while not converged and count < max_iter:
+        j = z[i] # current cluster
+        if s[j] <= 1:
+            n_skipped += 1
+            continue
         
-        n_changed = 0
+        Q_xi = QZ[i] # cost of x_i with each cluster
+        Aj = (1.0/(s[j]-w[i]))*(w[i]*q[j]/s[j] - 2*Q_xi[j] + g[i])
+        Al = (1.0/(s+w[i]))*(w[i]*q/s - 2*Q_xi - g[i])
+        delta_q = Aj - Al
+        delta_q[j] = -np.inf
+            
+        j_star = np.argmax(delta_q)
+        if delta_q[j_star] > 0:
+            z[i] = j_star
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            q[j] = q[j] - 2*Q_xi[j] + g[i]
+            q[j_star] = q[j_star] + 2*Q_xi[j_star] + g[i]
+            QZ[:,j] -= Gtilde[i-start]
+            QZ[:,j_star] += Gtilde[i-start]
+            n_changed += 1
+    return n_changed, n_skipped
+
+def _kmeans_sweep(z, QZ, Gtilde, g, w, s, q, start=0):
+    """One pass of kernel k-means over the points whose rows of Gtilde are
+    given. Return the number of points that changed cluster (and zero
+    skipped points).
+    
+    """
+    n_changed = 0
+    for i in range(start, start+len(Gtilde)): # for each data point
+    
+        j = z[i] # current cluster
+        Q_xi = QZ[i] # cost of x_i with each cluster
+        costs = q/(s**2) - 2*Q_xi/s
+        
+        j_star = np.argmin(costs)
+        
+        if j_star != j:
+            z[i] = j_star
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            q[j] = q[j] - 2*Q_xi[j] + g[i]
+            q[j_star] = q[j_star] + 2*Q_xi[j_star] + g[i]
+            QZ[:,j] -= Gtilde[i-start]
+            QZ[:,j_star] += Gtilde[i-start]
+            n_changed += 1
+    return n_changed, 0
+
+def _kgroups_lowrank_sweep(z, S, F, g, w, s, q, start=0):
+    """Same as _kgroups_sweep for Gtilde = F F^T, with the k x r cluster
+    sums S_l = sum_{j in C_l} F_j in place of the affinities. The affinity
+    of x_i with each cluster costs O(rk) and a move updates two rows of S.
+
+    """
+    n_changed = 0
+    n_skipped = 0
+    for i in range(start, start+len(F)): # for each data point
+    
+        j = z[i] # current cluster
+        if s[j] <= 1:
+            n_skipped += 1
+            continue
+        
+        Q_xi = S.dot(F[i-start]) # cost of x_i with each cluster
+        Aj = (1.0/(s[j]-w[i]))*(w[i]*q[j]/s[j] - 2*Q_xi[j] + g[i])
+        Al = (1.0/(s+w[i]))*(w[i]*q/s - 2*Q_xi - g[i])
+        delta_q = Aj - Al
+        delta_q[j] = -np.inf
+            
+        j_star = np.argmax(delta_q)
+        if delta_q[j_star] > 0:
+            z[i] = j_star
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            q[j] = q[j] - 2*Q_xi[j] + g[i]
+            q[j_star] = q[j_star] + 2*Q_xi[j_star] + g[i]
+            S[j] -= F[i-start]
+            S[j_star] += F[i-start]
+            n_changed += 1
+    return n_changed, n_skipped
+
+def _kmeans_lowrank_sweep(z, S, F, g, w, s, q, start=0):
+    """Same as _kmeans_sweep for Gtilde = F F^T, with cluster sums S as in
+    _kgroups_lowrank_sweep.
+    
+    """
+    n_changed = 0
+    for i in range(start, start+len(F)): # for each data point
+    
+        j = z[i] # current cluster
+        Q_xi = S.dot(F[i-start]) # cost of x_i with each cluster
+        costs = q/(s**2) - 2*Q_xi/s
+        
+        j_star = np.argmin(costs)
+        
+        if j_star != j:
+            z[i] = j_star
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            q[j] = q[j] - 2*Q_xi[j] + g[i]
+            q[j_star] = q[j_star] + 2*Q_xi[j_star] + g[i]
+            S[j] -= F[i-start]
+            S[j_star] += F[i-start]
+            n_changed += 1
+    return n_changed, 0
 
-        for i in range(n): # for each data point
+def _kgroups_sparse_sweep(z, QB, indptr, indices, data, u, v, U, V,
+                          g, w, s, q):
+    """Same as _kgroups_sweep for Gtilde = B + u v^T + v u^T with B sparse
+    in CSR format (indptr, indices, data). QB holds the affinities B Z
+    and U, V the sums of u and v in each cluster, so the affinity of x_i
+    with each cluster costs O(k) and a move updates QB at the neighbors of
+    x_i only.
+
+    """
+    n = len(z)
+    n_changed = 0
+    n_skipped = 0
+    for i in range(n): # for each data point
+    
+        j = z[i] # current cluster
+        if s[j] <= 1:
+            n_skipped += 1
+            continue
         
-            j = np.where(Z[i]==1)[0][0] # current cluster
-            Qj_xi = Gtilde[i,:].dot(Z[:,j]) # cost of x_i with C_j
+        Q_xi = QB[i] + u[i]*V + v[i]*U # cost of x_i with each cluster
+        Aj = (1.0/(s[j]-w[i]))*(w[i]*q[j]/s[j] - 2*Q_xi[j] + g[i])
+        Al = (1.0/(s+w[i]))*(w[i]*q/s - 2*Q_xi - g[i])
+        delta_q = Aj - Al
+        delta_q[j] = -np.inf
             
-            if s[j] <= 1:
-                count += 1
-                continue
+        j_star = np.argmax(delta_q)
+        if delta_q[j_star] > 0:
+            z[i] = j_star
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            q[j] = q[j] - 2*Q_xi[j] + g[i]
+            q[j_star] = q[j_star] + 2*Q_xi[j_star] + g[i]
+            nbrs = indices[indptr[i]:indptr[i+1]]
+            QB[nbrs,j] -= data[indptr[i]:indptr[i+1]]
+            QB[nbrs,j_star] += data[indptr[i]:indptr[i+1]]
+            U[j] -= u[i]
+            U[j_star] += u[i]
+            V[j] -= v[i]
+            V[j_star] += v[i]
+            n_changed += 1
+    return n_changed, n_skipped
+
+def _kmeans_sparse_sweep(z, QB, indptr, indices, data, u, v, U, V,
+                         g, w, s, q):
+    """Same as _kmeans_sweep for a sparse Gtilde, as in
+    _kgroups_sparse_sweep.
+    
+    """
+    n = len(z)
+    n_changed = 0
+    for i in range(n): # for each data point
+    
+        j = z[i] # current cluster
+        Q_xi = QB[i] + u[i]*V + v[i]*U # cost of x_i with each cluster
+        costs = q/(s**2) - 2*Q_xi/s
+        
+        j_star = np.argmin(costs)
+        
+        if j_star != j:
+            z[i] = j_star
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            q[j] = q[j] - 2*Q_xi[j] + g[i]
+            q[j_star] = q[j_star] + 2*Q_xi[j_star] + g[i]
+            nbrs = indices[indptr[i]:indptr[i+1]]
+            QB[nbrs,j] -= data[indptr[i]:indptr[i+1]]
+            QB[nbrs,j_star] += data[indptr[i]:indptr[i+1]]
+            U[j] -= u[i]
+            U[j_star] += u[i]
+            V[j] -= v[i]
+            V[j_star] += v[i]
+            n_changed += 1
+    return n_changed, 0
+
+def _kgroups_centroid_sweep(z, M, Phi, pn, w, s, mn):
+    """Hartigan pass over all points in feature space, with the k x r
+    weighted centroids M, their squared norms mn and the squared norms pn
+    of the rows of Phi. Moving x_i from C_j to C_l changes the objective by
+    w_i s_j/(s_j-w_i) |phi_i-mu_j|^2 - w_i s_l/(s_l+w_i) |phi_i-mu_l|^2,
+    which is the same change used by _kgroups_sweep.
+
+    """
+    n = len(z)
+    n_changed = 0
+    n_skipped = 0
+    for i in range(n): # for each data point
+    
+        j = z[i] # current cluster
+        if s[j] <= 1:
+            n_skipped += 1
+            continue
         
-            Aj = (1.0/(s[j]-w[i]))*(w[i]*q[j]/s[j] - 2*Qj_xi + Gtilde[i,i])
-
-            delta_q = np.zeros(k) 
-            Qplus = np.zeros(k) # store point costs to avoid recomputing below
-            for l in range(k):
-                
-                if l == j:
-                    delta_q[l] = -np.inf
-                    continue
-                
-                Ql_xi = Gtilde[i,:].dot(Z[:,l]) # cost of x_i with C_l
-                Qplus[l] = Ql_xi
-
-                Al = (1.0/(s[l]+w[i]))*(w[i]*q[l]/s[l] - 2*Ql_xi - Gtilde[i,i])
-
-                delta_q[l] = Aj - Al
-                
-            j_star = np.argmax(delta_q)
-            if delta_q[j_star] > 0:
-                Z[i,j] = 0
-                Z[i,j_star] = 1
-                s[j] -= w[i]
-                s[j_star] += w[i]
-                q[j] = q[j] - 2*Qj_xi + Gtilde[i,i]
-                q[j_star] = q[j_star] + 2*Qplus[j_star] + Gtilde[i,i]
-                n_changed += 1
+        d = pn[i] - 2*M.dot(Phi[i]) + mn # distances to centroids
+        delta_q = w[i]*s[j]/(s[j]-w[i])*d[j] - w[i]*s/(s+w[i])*d
+        delta_q[j] = -np.inf
+            
+        j_star = np.argmax(delta_q)
+        if delta_q[j_star] > 0:
+            z[i] = j_star
+            M[j] = (s[j]*M[j] - w[i]*Phi[i])/(s[j]-w[i])
+            M[j_star] = (s[j_star]*M[j_star] + w[i]*Phi[i])/(s[j_star]+w[i])
+            s[j] -= w[i]
+            s[j_star] += w[i]
+            mn[j] = M[j].dot(M[j])
+            mn[j_star] = M[j_star].dot(M[j_star])
+            n_changed += 1
+    return n_changed, n_skipped
+
+def _get_sweep(name, backend):
+    """Return the sweep function for the given backend."""
+    if backend == 'auto':
+        backend = 'python' if compiled is None else 'numba'
+    if backend == 'python':
+        return globals()['_%s_sweep' % name]
+    elif backend == 'numba':
+        if compiled is None:
+            raise ImportError("backend='numba' requires numba to be "
+                              "installed.")
+        return getattr(compiled, '%s_sweep' % name)
+    else:
+        raise ValueError("Unknown backend '%s'." % backend)
+
+class Trace(object):
+    """Callback for the optimizers that logs every sweep. Each record is a
+    dict with the sweep number, its wall time in seconds, the number of
+    points moved, the objective function after it and the sum of weights
+    of each cluster (its size, with unit weights). trace[key] returns one
+    field for all sweeps as an array, e.g. trace['objective'].
+
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, key):
+        return np.array([r[key] for r in self.records])
+
+def _report(callback, sweep, tic, moves, q, s):
+    callback(dict(sweep=sweep, time=timer()-tic, moves=int(moves),
+                  objective=objective_stats(q, s), sizes=np.array(s)))
 
+def _optimize(name, k, G, z0, W, max_iter, tol, backend, callback=None):
+    """Run sweeps of the given method until the fraction of points that
+    change cluster is below tol. Return labels, number of iterations and
+    the final objective function. If callback is given it is called after
+    every sweep with a record as described in ``Trace``; otherwise nothing
+    is timed or computed for it.
+
+    Labels are kept in an integer vector and the affinities
+    Q_l(x_i) = sum_{j in C_l} Gtilde_ij of every point with every cluster
+    in an n x k matrix, so a sweep costs O(nk) and each accepted move
+    updates only two of its columns, in O(n). If G is a ``LowRankKernel``
+    of rank r the k cluster sums of its factor are kept instead, so the
+    n x n kernel is never formed and a sweep costs O(nrk). A memory mapped
+    G is never loaded whole: each sweep reads it in blocks of rows, which
+    are visited in file order. A float32 G is kept as float32, while the
+    affinities and the statistics q and s are float64. For a
+    ``SparseKernel`` only the affinities with its sparse part are kept, and
+    a move updates them at the nonzeros of one row.
+
+    """
+    lowrank = isinstance(G, LowRankKernel)
+    sparse_kernel = isinstance(G, SparseKernel)
+    suffix = '_lowrank' if lowrank else '_sparse' if sparse_kernel else ''
+    sweep = _get_sweep(name + suffix, backend)
+    n = G.shape[0]
+    z, _ = _labels(z0) # current cluster of each point
+    w = np.ascontiguousarray(weights(W, n), dtype=np.float64) # weights
+    if sparse_kernel:
+        Gtilde = weighted_kernel(G, w) # absorb weights into B, u and v
+        B, u, v = Gtilde.B, Gtilde.u, Gtilde.v
+        cache = B.dot(_onehot(z, k)).toarray() # affinities with B
+        U = np.bincount(z, weights=u, minlength=k)
+        V = np.bincount(z, weights=v, minlength=k)
+        Q_own = cache[np.arange(n), z] + u*V[z] + v*U[z]
+        g = Gtilde.diagonal()
+    elif lowrank:
+        Gtilde = weighted_kernel(G, w) # absorb weights into the factor
+        blocks = lambda: [(0, Gtilde.Phi)]
+        cache = np.asarray(_onehot(z, k).T.dot(Gtilde.Phi)) # cluster sums
+        Q_own = np.einsum('ij,ij->i', Gtilde.Phi, cache[z])
+        g = Gtilde.diagonal()
+    else:
+        if isinstance(G, np.memmap): # blocks of Gtilde are read every sweep
+            blocks = lambda: _row_tiles(G, w)
+            tiles = blocks
+            g = w*w*G.diagonal()
+        else:
+            Gtilde = weighted_kernel(G, w) # absorb weights into a new matrix
+            dtype = np.float32 if G.dtype == np.float32 else np.float64
+            Gtilde = np.ascontiguousarray(Gtilde, dtype=dtype)
+            blocks = lambda: [(0, Gtilde)]
+            tiles = lambda: _row_tiles(Gtilde)
+            g = np.array(Gtilde.diagonal(), dtype=np.float64)
+        Z = _onehot(z, k)
+        cache = np.empty((n, k)) # affinities with clusters
+        for start, rows in tiles():
+            QZ = np.asarray(Z.T.dot(rows.T)).T
+            cache[start:start+len(rows)] = QZ
+        Q_own = cache[np.arange(n), z]
+    s = np.bincount(z, weights=w, minlength=k) # sum of weights in clusters
+    q = np.bincount(z, weights=Q_own, minlength=k) # costs
+    
+    def run_sweep():
+        if sparse_kernel:
+            return sweep(z, cache, B.indptr, B.indices, B.data, u, v, U, V,
+                         g, w, s, q)
+        n_changed = 0
+        n_skipped = 0
+        for start, rows in blocks():
+            changed, skipped = sweep(z, cache, rows, g, w, s, q, start)
+            n_changed += changed
+            n_skipped += skipped
+        return n_changed, n_skipped
+    
+    count = 0
+    sweeps = 0
+    converged = False
+    while not converged and count < max_iter:
+        if callback is not None:
+            tic = timer()
+        n_changed, n_skipped = run_sweep()
+        sweeps += 1
+        if callback is not None:
+            _report(callback, sweeps, tic, n_changed, q, s)
+        count += n_skipped
         if n_changed/n < tol:
             converged = True
         else:
             count += 1
+    return z, count, objective_stats(q, s)
+
+def _labels_output(z, k, return_Z, obj, return_objective):
+    out = ztoZ(z, k) if return_Z else z
+    if return_objective:
+        return out, obj
+    return out
+
+def kernel_kgroups(k, G, z0, W=None, max_iter=100, tol=1e-4, verbose=False,
+                   return_Z=False, backend='auto', return_objective=False,
+                   callback=None):
+    """Optimize the W objective function by considering moving points
+    to different partitions. Compute the change in the cost function by
+    moving a point then decide the best partition to optimize the cost
+    function. 
+
+    G is the kernel matrix (possibly memory mapped) or a ``LowRankKernel``
+    or ``SparseKernel`` approximating it.
+    z0 is the initial label vector (an n x k label matrix is also accepted)
+    and W the weights as accepted by ``weights``, preferably a vector.
+    Return the final int32 label vector, or the label matrix if return_Z.
+    If return_objective also return the final objective function, which is
+    obtained from the cluster statistics at no extra cost.
+
+    backend='numba' runs the sweeps compiled, 'python' uses the pure
+    Python reference and 'auto' picks numba when it is installed. Both
+    give the same labels.
+
+    callback, e.g. a ``Trace``, is called after every sweep with its wall
+    time, number of moves, objective function and cluster sizes.
+    
+    """
+    z, count, obj = _optimize('kgroups', k, G, z0, W, max_iter, tol, backend,
+                              callback)
 
     if verbose:
         if count >= max_iter:
-            print "\tKernel k-groups didn't in %i iterations." % count
+            print "\tKernel k-groups didn't converge in %i iterations." % \
+                                                                        count
         else:
             print "\tKernel k-groups converged in %i iterations." % count
 
-    if return_Z:
-        return Z
-    else:
-        return Ztoz(Z)
+    return _labels_output(z, k, return_Z, obj, return_objective)
 
-def kernel_kmeans(k, G, Z0, W, max_iter=100, tol=1e-4, verbose=False,
-                    return_Z=False):
+def kernel_kmeans(k, G, z0, W=None, max_iter=100, tol=1e-4, verbose=False,
+                    return_Z=False, backend='auto', return_objective=False,
+                    callback=None):
     """Optimize QCQP through a kernel k-means approach, which is based
-    on Lloyd's heuristic.
+    on Lloyd's heuristic. Input, output, backend and callback are as in
+    kernel_kgroups.
     
     """
-    n = G.shape[0]
-    Z = np.copy(Z0)
-    Zt = Z.T
-    Gtilde = W.dot(G.dot(W)) # absorb weights into a new matrix
-    Q_matrix = Zt.dot(Gtilde.dot(Z))  
-    w = W.dot(np.ones(n)) # vector containing weights
-    s = list(Zt.dot(w)) # vector of s_i's, sum of weights in each cluster
-    q = list(np.diag(Q_matrix)) # vector with costs of each cluster
+    z, count, obj = _optimize('kmeans', k, G, z0, W, max_iter, tol, backend,
+                              callback)
 
-    count = 0
-    converged = False
-    while not converged and count < max_iter:
-        
-        n_changed = 0
+    if verbose:
+        if count >= max_iter:
+            print "\tKernel k-means didn't converge in %i iterations." % \
+                                                                        count
+        else:
+            print "\tKernel k-means converged in %i iterations." % count
+    
+    return _labels_output(z, k, return_Z, obj, return_objective)
+
+def kernel_kgroups_batch(k, G, z0, W=None, max_iter=100, tol=1e-4,
+                         verbose=False, return_objective=False):
+    """Run kernel k-groups from R initializations at once. 
+    
+    z0 is an R x n array with the initial labels of each restart. The
+    affinities of all restarts are obtained with a single product of Gtilde
+    with the n x Rk one-hot matrix, and the move of each point is then
+    decided for all restarts together, so the Python overhead per point is
+    shared by the R runs. Each restart stops as kernel_kgroups would, and
+    gives the same labels up to floating point round-off.
+
+    Return the R x n array of final labels and, if return_objective, the
+    final objective function of each restart.
+
+    """
+    z = np.array(z0, dtype=np.int32, ndmin=2)
+    R, n = z.shape
+    rows = np.arange(R)
+    w = weights(W, n)
+    if isinstance(G, np.memmap): # blocks of Gtilde are read every sweep
+        blocks = lambda: _row_tiles(G, w)
+        tiles = blocks
+        g = w*w*G.diagonal()
+    else:
+        Gtilde = weighted_kernel(G, w)
+        blocks = lambda: [(0, Gtilde)]
+        tiles = lambda: _row_tiles(Gtilde)
+        g = np.array(np.diag(Gtilde), dtype=np.float64)
+    
+    # QZt[r*k+l] is the affinity of every point with cluster l of restart r
+    cols = (rows[:,np.newaxis]*k + z).ravel()
+    Z = np.zeros((R*k, n))
+    Z[cols, np.tile(np.arange(n), R)] = 1
+    QZt = np.empty((R*k, n))
+    for start, G_rows in tiles():
+        QZt[:,start:start+len(G_rows)] = Z.dot(G_rows.T)
+    del Z
+    s = np.array([np.bincount(z[r], weights=w, minlength=k) 
+                  for r in range(R)])
+    q = np.array([np.bincount(z[r], weights=QZt[r*k+z[r], np.arange(n)],
+                              minlength=k) for r in range(R)])
 
-        for i in range(n): # for each data point
+    count = np.zeros(R, dtype=int)
+    running = np.ones(R, dtype=bool)
+    while running.any():
         
-            j = np.where(Z[i]==1)[0][0] # current cluster
-            costs = np.zeros(k)
-            qxs = np.zeros(k)
-            for l in range(k):
-                Ql_xi = Gtilde[i,:].dot(Z[:,l])
-                qxs[l] = Ql_xi
-                Jl_xi = q[l]/(s[l]**2) - 2*Ql_xi/s[l]
-                costs[l] = Jl_xi
+        n_changed = np.zeros(R, dtype=int)
+
+        for start, G_rows in blocks():
+            for i in range(start, start+len(G_rows)): # for each data point
+
+                j = z[:,i] # current cluster in each restart
+                Q_xi = QZt[:,i].reshape(R, k) # cost of x_i with each cluster
+                sj = s[rows,j]
+                qj = q[rows,j]
+                Qj = Q_xi[rows,j]
+                skip = running & (sj <= 1)
+                count += skip
             
-            j_star = np.argmin(costs)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    Aj = (1.0/(sj-w[i]))*(w[i]*qj/sj - 2*Qj + g[i])
+                    Al = (1.0/(s+w[i]))*(w[i]*q/s - 2*Q_xi - g[i])
+                    delta_q = Aj[:,np.newaxis] - Al
+                delta_q[rows,j] = -np.inf
+                j_star = np.argmax(delta_q, axis=1)
+                move = running & ~skip & (delta_q[rows,j_star] > 0)
             
-            if j_star != j:
-                Z[i,j] = 0
-                Z[i,j_star] = 1
-                s[j] -= w[i]
-                s[j_star] += w[i]
-                q[j] = q[j] - 2*qxs[j]
-                q[j_star] = q[j_star] + 2*qxs[j_star]
-                n_changed += 1
+                if move.any():
+                    r = rows[move]
+                    jr = j[move]
+                    jr_star = j_star[move]
+                    s[r,jr] -= w[i]
+                    s[r,jr_star] += w[i]
+                    q[r,jr] = q[r,jr] - 2*Q_xi[r,jr] + g[i]
+                    q[r,jr_star] = q[r,jr_star] + 2*Q_xi[r,jr_star] + g[i]
+                    QZt[r*k+jr] -= G_rows[i-start]
+                    QZt[r*k+jr_star] += G_rows[i-start]
+                    z[r,i] = jr_star
+                    n_changed[r] += 1
+
+        converged = running & (n_changed/n < tol)
+        count += running & ~converged
+        running &= ~converged & (count < max_iter)
+
+    if verbose:
+        print "\tKernel k-groups (%i restarts) took %i to %i iterations." % \
+                                                (R, count.min(), count.max())
+
+    if return_objective:
+        return z, np.array([objective_stats(q[t], s[t]) for t in range(R)])
+    return z
+
+
+def _centroids(z, k, Phi, w):
+    """Weighted centroids of the rows of Phi and sum of weights in each
+    cluster. Empty clusters get a zero centroid.
+    
+    """
+    S = np.asarray(_onehot(z, k, w).T.dot(Phi))
+    s = np.bincount(z, weights=w, minlength=k)
+    nonempty = s > 0
+    S[nonempty] /= s[nonempty,np.newaxis]
+    return S, s
 
+def _features(Phi):
+    if isinstance(Phi, LowRankKernel):
+        return Phi.Phi
+    return np.ascontiguousarray(Phi, dtype=np.float64)
+
+def kernel_kmeans_features(k, Phi, z0, W=None, max_iter=100, tol=1e-4,
+                           verbose=False, return_Z=False,
+                           return_objective=False, callback=None):
+    """Kernel k-means with the kernel given by its n x r factor,
+    G = Phi Phi^T, e.g. from ``nystrom.nystrom`` (a ``LowRankKernel`` is
+    also accepted). This is Lloyd's heuristic on explicit weighted
+    centroids: every iteration assigns all points at once with one
+    (n x r).(r x k) product and then recomputes the centroids, so it costs
+    O(nrk). An empty cluster keeps its previous centroid. Input, output
+    and callback are as in kernel_kmeans.
+
+    """
+    Phi = _features(Phi)
+    n = Phi.shape[0]
+    z, _ = _labels(z0)
+    w = weights(W, n)
+    M, s = _centroids(z, k, Phi, w)
+    empty = s == 0
+    
+    count = 0
+    sweeps = 0
+    converged = False
+    while not converged and count < max_iter:
+        if callback is not None:
+            tic = timer()
+        D = Phi.dot(M.T) # assignment: argmin |mu_l|^2 - 2 phi_i.mu_l
+        D *= -2
+        D += (M**2).sum(axis=1)
+        D[:,empty] = np.inf
+        zn = np.argmin(D, axis=1).astype(np.int32)
+        n_changed = (zn != z).sum()
+        z = zn
+        M_old = M
+        M, s = _centroids(z, k, Phi, w)
+        empty &= s == 0
+        M[s == 0] = M_old[s == 0]
+        sweeps += 1
+        if callback is not None:
+            _report(callback, sweeps, tic, n_changed,
+                    s*s*(M**2).sum(axis=1), s)
         if n_changed/n < tol:
             converged = True
         else:
@@ -178,20 +1069,62 @@ def kernel_kmeans(k, G, Z0, W, max_iter=100, tol=1e-4, verbose=False,
             print "\tKernel k-means didn't converge in %i iterations." % \
                                                                         count
         else:
-            print "\tKernel k-means didn't converge in %i iterations." % count
-    
-    if return_Z:
-        return Z
-    else:
-        return Ztoz(Z)
+            print "\tKernel k-means converged in %i iterations." % count
+
+    obj = objective_stats(s*s*(M**2).sum(axis=1), s)
+    return _labels_output(z, k, return_Z, obj, return_objective)
+
+def kernel_kgroups_features(k, Phi, z0, W=None, max_iter=100, tol=1e-4,
+                            verbose=False, return_Z=False, backend='auto',
+                            return_objective=False, callback=None):
+    """Kernel k-groups with the kernel given by its n x r factor,
+    G = Phi Phi^T. Hartigan moves are decided from the distances to the
+    k weighted centroids, which are updated in O(r) after each move, so a
+    sweep costs O(nrk). Input, output, backend and callback are as in
+    kernel_kgroups, and the labels are the same up to floating point
+    round-off.
+
+    """
+    sweep = _get_sweep('kgroups_centroid', backend)
+    Phi = _features(Phi)
+    n = Phi.shape[0]
+    z, _ = _labels(z0)
+    w = np.ascontiguousarray(weights(W, n), dtype=np.float64)
+    M, s = _centroids(z, k, Phi, w)
+    pn = (Phi**2).sum(axis=1)
+    mn = (M**2).sum(axis=1)
 
+    count = 0
+    sweeps = 0
+    converged = False
+    while not converged and count < max_iter:
+        if callback is not None:
+            tic = timer()
+        n_changed, n_skipped = sweep(z, M, Phi, pn, w, s, mn)
+        sweeps += 1
+        if callback is not None:
+            _report(callback, sweeps, tic, n_changed, s*s*mn, s)
+        count += n_skipped
+        if n_changed/n < tol:
+            converged = True
+        else:
+            count += 1
+    
+    if verbose:
+        if count >= max_iter:
+            print "\tKernel k-groups didn't converge in %i iterations." % \
+                                                                        count
+        else:
+            print "\tKernel k-groups converged in %i iterations." % count
+    
+    return _labels_output(z, k, return_Z, objective_stats(s*s*mn, s),
+                          return_objective)
 
 ###############################################################################
 if __name__ == '__main__':
     
     from sklearn.mixture import GaussianMixture as GMM
     from sklearn.cluster import KMeans
-    from timeit import default_timer as timer
     from prettytable import PrettyTable 
     
     import data
@@ -208,46 +1141,40 @@ if __name__ == '__main__':
     s2 = np.eye(D)
     X, z = data.multivariate_lognormal([m1, m2], [s1, s2], [n1, n2])
     k = 2
-    W = np.diag(np.random.normal(1, 0.01, n1+n2))
+    W = np.random.normal(1, 0.01, n1+n2)
 
-    rho = lambda x,y: np.power(np.linalg.norm(x-y), 1)
+    rho = Semimetric('power', 1)
     G = kernel_matrix(X, rho)
     
     # initialization
     z0, mu0 = init.kmeans_plus2(k, X)
-    Z0 = ztoZ(z0)
     z1 = init.spectral(k, G, W)
-    Z1 = ztoZ(z1)
 
     t = PrettyTable(["Method", "Accuracy", "Objective", "Exec Time"])
     
     start = timer()
-    zh = kernel_kgroups(k, G, Z0, W)
+    zh = kernel_kgroups(k, G, z0, W)
     end = timer()
-    Zh = ztoZ(zh)
     t.add_row(["kernel k-groups (k-means++)", metric.accuracy(z, zh), 
-                  objective(Zh, G, W), end-start])
+                  objective(zh, G, W), end-start])
     
     start = timer()
-    zh = kernel_kgroups(k, G, Z1, W)
+    zh = kernel_kgroups(k, G, z1, W)
     end = timer()
-    Zh = ztoZ(zh)
     t.add_row(["kernel k-groups (spectral)", metric.accuracy(z, zh), 
-                  objective(Zh, G, W), end-start])
+                  objective(zh, G, W), end-start])
     
     start = timer()
-    zh = kernel_kmeans(k, G, Z0, W)
+    zh = kernel_kmeans(k, G, z0, W)
     end = timer()
-    Zh = ztoZ(zh)
     t.add_row(["kernel k-means (k-means++)", metric.accuracy(z, zh), 
-                  objective(Zh, G, W), end-start])
+                  objective(zh, G, W), end-start])
     
     start = timer()
-    zh = kernel_kmeans(k, G, Z1, W)
+    zh = kernel_kmeans(k, G, z1, W)
     end = timer()
-    Zh = ztoZ(zh)
     t.add_row(["kernel k-means (spectral)", metric.accuracy(z, zh), 
-                  objective(Zh, G, W), end-start])
+                  objective(zh, G, W), end-start])
     
     start = timer()
     gmm = GMM(k)
@@ -0,0 +1,236 @@
+"""Exact energy statistics clustering in 1D.
+
+Once the data is sorted the optimal partition in two clusters is a split
+point, and the within dispersion of every prefix and suffix follows from
+cumulative sums. All n-1 splits are thus evaluated in O(n), after the
+O(n log n) sort, with no initialization.
+
+For k clusters the optimal partition is made of k contiguous segments of
+the sorted data, and the cost of any segment is O(1) from prefix sums, so
+it is found by dynamic programming over the sorted points. No kernel
+matrix is ever formed.
+
+"""
+
+# Guilherme Franca <guifranca@gmail.com>
+# Johns Hopkins University
+
+from __future__ import division
+
+import numpy as np
+
+import eclust
+
+
+def _sorted(x, W=None):
+    """Sort x and its weights. Return the sorting indices, values centered
+    at their weighted mean (which leaves the dispersion unchanged but
+    reduces round-off) and weights.
+
+    """
+    x = np.asarray(x, dtype=float).ravel()
+    w = np.asarray(eclust.weights(W, len(x)), dtype=float)
+    idx = np.argsort(x, kind='mergesort')
+    y = x[idx]
+    w = w[idx]
+    y = y - np.dot(w, y)/w.sum()
+    return idx, y, w
+
+def _prefix_dispersion(y, w):
+    """D[m] = sum_{i<j<m} w_i w_j (y_j - y_i) for sorted y, m = 1..n."""
+    Wc = np.cumsum(w)
+    Sc = np.cumsum(w*y)
+    D = np.empty_like(y)
+    D[0] = 0
+    D[1:] = w[1:]*(y[1:]*Wc[:-1] - Sc[:-1])
+    return np.cumsum(D), Wc
+
+def dispersion1D(x, W=None):
+    """Weighted within dispersion of one sample,
+    sum_{i<j} w_i w_j |x_i - x_j| / sum_i w_i, in O(n log n). With unit
+    weights this is n/2 times the energy mean g(x, x).
+
+    """
+    _, y, w = _sorted(x, W)
+    D, Wc = _prefix_dispersion(y, w)
+    return D[-1]/Wc[-1]
+
+def split_costs1D(x, W=None):
+    """Objective of every split of the sorted data in two clusters.
+    Return the sorting indices and the n-1 costs, where costs[m-1] is the
+    sum of the within dispersions of the m smallest and of the n-m largest
+    points.
+
+    """
+    idx, y, w = _sorted(x, W)
+    if len(y) < 2:
+        raise ValueError("Need at least 2 points, got n=%i." % len(y))
+    D_left, W_left = _prefix_dispersion(y, w)
+    D_right, W_right = _prefix_dispersion(-y[::-1], w[::-1])
+    costs = D_left[:-1]/W_left[:-1] + (D_right/W_right)[-2::-1]
+    return idx, costs
+
+def two_clusters1D(x, W=None, return_costs=False):
+    """Optimize within energy statistics for two clusters in 1D, exactly.
+
+    x is the data (a vector, or n x 1 matrix) and W the weights as accepted
+    by ``eclust.weights``. Return the labels, with 0 for the cluster of the
+    smallest points, and the optimal within dispersion. If return_costs
+    also return the cost of every split, as in ``split_costs1D``.
+
+    """
+    idx, costs = split_costs1D(x, W)
+    m = np.argmin(costs) + 1
+    labels = np.zeros(len(idx), dtype=int)
+    labels[idx[m:]] = 1
+    if return_costs:
+        return labels, costs[m-1], costs
+    return labels, costs[m-1]
+
+def _segment_cost(a, b, P, Wc, Sc):
+    """Within dispersion of the sorted points a..b-1 (a < b), from the
+    prefix sums of ``_prefix_sums``. Works elementwise on arrays."""
+    D = P[b] - P[a] - Wc[a]*Sc[b] + Sc[a]*Wc[b]
+    return D/(Wc[b] - Wc[a])
+
+def _prefix_sums(y, w):
+    """Prefix dispersion, weight and weighted sum of the first m sorted
+    points, for m = 0..n."""
+    D, Wc = _prefix_dispersion(y, w)
+    zero = np.zeros(1)
+    return np.r_[zero, D], np.r_[zero, Wc], np.r_[zero, np.cumsum(w*y)]
+
+def _layer_exact(prev, l, n, sums):
+    """C[b] = min_a prev[a] + cost(a, b) for b = l..n, over all a < b with
+    a >= l-1, in O(n^2)."""
+    C = np.full(n+1, np.inf)
+    opt = np.zeros(n+1, dtype=np.int32)
+    for b in range(l, n+1):
+        a = np.arange(l-1, b)
+        vals = prev[a] + _segment_cost(a, b, *sums)
+        j = np.argmin(vals)
+        C[b] = vals[j]
+        opt[b] = a[j]
+    return C, opt
+
+def _layer_divide(prev, l, n, sums):
+    """Same as ``_layer_exact`` assuming the optimal a is nondecreasing in
+    b, by divide and conquer: the midpoints of all current ranges of b are
+    solved together with one vectorized pass, which halves the ranges and
+    the candidates of each. This costs O(n log n) per layer.
+
+    """
+    C = np.full(n+1, np.inf)
+    opt = np.zeros(n+1, dtype=np.int32)
+    # ranges [blo, bhi] of b, with optimal a in [alo, ahi]
+    blo = np.array([l])
+    bhi = np.array([n])
+    alo = np.array([l-1])
+    ahi = np.array([n-1])
+    while len(blo):
+        mid = (blo + bhi)//2
+        hi = np.minimum(ahi, mid-1)
+        lengths = hi - alo + 1
+        starts = np.r_[0, np.cumsum(lengths)[:-1]]
+        seg = np.repeat(np.arange(len(mid)), lengths)
+        a = alo[seg] + np.arange(lengths.sum()) - starts[seg]
+        vals = prev[a] + _segment_cost(a, mid[seg], *sums)
+        best = np.minimum.reduceat(vals, starts)
+        first = np.flatnonzero(vals == best[seg])
+        first = first[np.r_[True, seg[first[1:]] != seg[first[:-1]]]]
+        C[mid] = best
+        opt[mid] = a[first]
+        left = blo < mid
+        right = mid < bhi
+        blo, bhi, alo, ahi = (np.r_[blo[left], mid[right]+1],
+                              np.r_[mid[left]-1, bhi[right]],
+                              np.r_[alo[left], opt[mid][right]],
+                              np.r_[opt[mid][left], ahi[right]])
+    return C, opt
+
+def kclusters1D(x, k, W=None, method='divide'):
+    """Globally optimal energy clustering of 1D data in k clusters.
+
+    C_l[b], the smallest within dispersion of the b smallest points in l
+    clusters, satisfies C_l[b] = min_a C_{l-1}[a] + cost(a, b), where
+    cost(a, b) is the dispersion of the sorted points a..b-1, so k layers
+    of this recursion give the optimum. With method='exact' every layer
+    tries all a, in O(n^2). With method='divide' (the default) the optimal
+    a is assumed nondecreasing in b, which holds for the energy cost in
+    practice and gives the same result in O(n log n) per layer; compare
+    both on a sample when in doubt.
+
+    x and W are as in ``two_clusters1D``. Return labels, ordered as the
+    data (0 for the smallest points), and the optimal within dispersion.
+
+    """
+    idx, y, w = _sorted(x, W)
+    n = len(y)
+    if not 1 <= k <= n:
+        raise ValueError("Need 1 <= k <= n, got k=%i, n=%i." % (k, n))
+    layer = {'exact': _layer_exact, 'divide': _layer_divide}[method]
+    sums = _prefix_sums(y, w)
+    C = np.full(n+1, np.inf)
+    C[1:] = _segment_cost(0, np.arange(1, n+1), *sums)
+    opts = []
+    for l in range(2, k+1):
+        if l < k:
+            C, opt = layer(C, l, n, sums)
+        else: # only b = n is needed in the last layer
+            a = np.arange(l-1, n)
+            vals = C[a] + _segment_cost(a, n, *sums)
+            C = np.full(n+1, np.inf)
+            C[n] = vals.min()
+            opt = np.zeros(n+1, dtype=np.int32)
+            opt[n] = a[np.argmin(vals)]
+        opts.append(opt)
+
+    # backtrack the segment boundaries
+    sorted_labels = np.empty(n, dtype=int)
+    b = n
+    for l in range(k-1, 0, -1):
+        a = opts[l-1][b]
+        sorted_labels[a:b] = l
+        b = a
+    sorted_labels[:b] = 0
+    labels = np.empty(n, dtype=int)
+    labels[idx] = sorted_labels
+    return labels, C[n]
+
+
+###############################################################################
+if __name__ == "__main__":
+
+    from timeit import default_timer as timer
+    from prettytable import PrettyTable
+
+    import data
+    import metric
+
+    def two_clusters1D_naive(x):
+        """Scan the splits and compute each dispersion from its pairs."""
+        y = np.sort(x)
+        pairs = lambda a: np.abs(a[:,np.newaxis] - a).sum()/(2*len(a))
+        costs = [pairs(y[:m]) + pairs(y[m:]) for m in range(1, len(y))]
+        return np.min(costs)
+
+    t = PrettyTable(["n", "Accuracy", "Cost", "Naive cost", "Exec Time"])
+    for n in [100, 1000, 1000000]:
+        x, z = data.univariate_lognormal([0, -1.5], [0.3, 1.5], [n, n])
+        start = timer()
+        zh, cost = two_clusters1D(x)
+        end = timer()
+        naive = two_clusters1D_naive(x) if n <= 1000 else "-"
+        t.add_row([2*n, metric.accuracy(z, zh), cost, naive, end-start])
+    print t
+
+    t = PrettyTable(["Method", "n", "k", "Accuracy", "Cost", "Exec Time"])
+    for n, methods in [(500, ['exact', 'divide']), (100000, ['divide'])]:
+        x, z = data.univariate_normal([0, 4, 8], [1, 1, 2], [n, n, n])
+        for method in methods:
+            start = timer()
+            zh, cost = kclusters1D(x, 3, method=method)
+            end = timer()
+            t.add_row([method, 3*n, 3, metric.accuracy(z, zh), cost,
+                       end-start])
+    print t
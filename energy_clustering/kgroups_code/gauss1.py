@@ -46,7 +46,7 @@ r = []
 for _ in range(num_experiments):
     for dim in dimensions:
         X, z = generate_data(dim)
-        G = eclust.kernel_matrix(X, lambda x, y: np.linalg.norm(x-y))
+        G = eclust.kernel_matrix(X, eclust.Semimetric('power', 1))
         
         zh = wrapper.kmeans(k, X)
         a = metric.accuracy(z, zh)
@@ -57,11 +57,11 @@ r = []
 for _ in range(num_experiments):
     for n in num_points:
         X, z = generate_data(n)
-        G1 = eclust.kernel_matrix(X, lambda x, y: np.linalg.norm(x-y))
+        G1 = eclust.kernel_matrix(X, eclust.Semimetric('power', 1))
         G2 = eclust.kernel_matrix(X, 
-                lambda x, y: np.power(np.linalg.norm(x-y), 0.5))
+                eclust.Semimetric('power', 0.5))
         G3 = eclust.kernel_matrix(X, 
-                lambda x, y: 2-2*np.exp(-np.linalg.norm(x-y)/2))
+                eclust.Semimetric('exp', 1))
         
         zh = wrapper.kmeans(k, X)
         a = metric.accuracy(z, zh)
@@ -48,7 +48,7 @@ r = []
 for _ in range(num_experiments):
     for m in num_points:
         X, z = generate_data(m)
-        G = eclust.kernel_matrix(X, lambda x, y: np.linalg.norm(x-y))
+        G = eclust.kernel_matrix(X, eclust.Semimetric('power', 1))
         
         zh = wrapper.kmeans(k, X)
         a = metric.accuracy(z, zh)
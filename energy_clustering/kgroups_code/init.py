@@ -5,70 +5,99 @@
 
 from __future__ import division
 
+import warnings
+
 import numpy as np
 from scipy.linalg import eigh
+from scipy.sparse.linalg import LinearOperator, eigsh, lobpcg
 from sklearn.cluster import KMeans
 from sklearn.cluster import SpectralClustering
 
 from sklearn.metrics.pairwise import pairwise_distances
 
+import eclust
 
 def euclidean_distance(x, y):
     return np.linalg.norm(x-y)**2
 
-def kmeans_plus(k, X):
-    """This is the k-means++ initialization proposed by Arthur and
-    Vassilvitskii (2007). We label the points according to closest
-    distance to the centers.
+def _kmeans_plus(K, X, n_trials=1):
+    """Choose K centers by k-means++ seeding. Keep the squared distance of
+    every point to its closest center, updated with one vectorized pass per
+    new center. With n_trials > 1 this is the greedy variant: sample
+    n_trials candidates and keep the one that most reduces the potential.
+    Return labels of the closest center and the indices of the centers.
     
     """
-    K = k
     N = X.shape[0]
-    distance = euclidean_distance
-    C = [X[np.random.randint(0, N)]] # centers
-    D = np.zeros(N)                  # distances
+    C = [np.random.randint(0, N)]    # centers
+    D = ((X - X[C[0]])**2).sum(axis=1) # distances to closest center
+    labels = np.zeros(N, dtype=np.int32)
     for k in range(1, K):
-        for n in range(N):
-            D[n] = np.array([distance(X[n], c) for c in C]).min()
         p = D/D.sum()
-        j = discrete_rv(p)
-        C.append(X[j])
-    mus = np.array(C)
-    
-    labels = np.empty(N, dtype=np.int8)
-    for n in range(N):
-        for k in range(K):
-            D = np.array([distance(X[n], mus[k]) for k in range(K)])
-            labels[n] = np.argmin(D)
+        if n_trials == 1:
+            j = discrete_rv(p)
+            Dj = ((X - X[j])**2).sum(axis=1)
+        else:
+            u = np.random.uniform(size=n_trials)
+            js = np.minimum(np.searchsorted(np.cumsum(p), u), N-1)
+            Djs = [((X - X[j])**2).sum(axis=1) for j in js]
+            best = np.argmin([np.minimum(D, Dj).sum() for Dj in Djs])
+            j, Dj = js[best], Djs[best]
+        C.append(j)
+        closer = Dj < D
+        labels[closer] = k
+        D[closer] = Dj[closer]
+    return labels, np.array(C)
+
+def kmeans_plus(k, X, n_trials=1):
+    """This is the k-means++ initialization proposed by Arthur and
+    Vassilvitskii (2007). We label the points according to closest
+    distance to the centers. n_trials > 1 gives greedy k-means++.
+    
+    """
+    labels, C = _kmeans_plus(k, X, n_trials)
     return labels
 
-def kmeans_plus2(k, X):
+def kmeans_plus2(k, X, n_trials=1):
     """This is the k-means++ initialization proposed by Arthur and
     Vassilvitskii (2007). We label the points according to closest
     distance to the centers.
 
     Same as above but return labels and means.
     
+    """
+    labels, C = _kmeans_plus(k, X, n_trials)
+    return labels, X[C]
+
+def kmeans_plus_kernel(k, G, W=None, n_trials=1):
+    """k-means++ seeding in the feature space of the kernel G, so no data
+    matrix is needed. The squared distance between points is
+    G_ii + G_jj - 2 G_ij, and each new center costs one row of G. If weights
+    W are given, points are sampled with probability proportional to their
+    weight times their distance to the closest center. n_trials > 1 gives
+    greedy k-means++ as in kmeans_plus. Return labels of the closest center.
+    
     """
     K = k
-    N = X.shape[0]
-    distance = euclidean_distance
-    C = [X[np.random.randint(0, N)]] # centers
-    D = np.zeros(N)                  # distances
+    N = G.shape[0]
+    w = eclust.weights(W, N)
+    g = np.array(G.diagonal(), dtype=float)
+    dist = lambda j: np.maximum(g + g[j] - 2*np.asarray(G[j], dtype=float), 0)
+    D = dist(np.random.randint(0, N)) # distances to closest center
+    labels = np.zeros(N, dtype=np.int32)
     for k in range(1, K):
-        for n in range(N):
-            D[n] = np.array([distance(X[n], c) for c in C]).min()
-        p = D/D.sum()
-        j = discrete_rv(p)
-        C.append(X[j])
-    mus = np.array(C)
-    
-    labels = np.empty(N, dtype=np.int8)
-    for n in range(N):
-        for k in range(K):
-            D = np.array([distance(X[n], mus[k]) for k in range(K)])
-            labels[n] = np.argmin(D)
-    return labels, mus
+        p = w*D/(w*D).sum()
+        if n_trials == 1:
+            Dj = dist(discrete_rv(p))
+        else:
+            u = np.random.uniform(size=n_trials)
+            js = np.minimum(np.searchsorted(np.cumsum(p), u), N-1)
+            Djs = [dist(j) for j in js]
+            Dj = Djs[np.argmin([(w*np.minimum(D, Dc)).sum() for Dc in Djs])]
+        closer = Dj < D
+        labels[closer] = k
+        D[closer] = Dj[closer]
+    return labels
 
 def discrete_rv(p):
     """Return an integer according to probability function p."""
@@ -77,24 +106,85 @@ def discrete_rv(p):
     j = np.searchsorted(cdf, u)
     return j
 
-def topeigen(k, G, W, run_times=1, init='k-means++'):
+# largest residual accepted from lobpcg in top_eigenvectors
+LOBPCG_TOL = 1e-6
+
+def top_eigenvectors(k, G, W=None, solver='auto'):
+    """Solve K y = lambda D y for the k largest eigenvalues, where
+    K = W^{1/2} G W^{1/2} with zero diagonal and D the diagonal matrix with
+    the degrees d = K 1.
+
+    The problem is turned into the standard symmetric one for
+    D^{-1/2} K D^{-1/2}, with y = D^{-1/2} u. solver='dense' builds this
+    matrix and uses LAPACK; 'arpack' (Lanczos) and 'lobpcg' only need
+    products with G, so no other n x n matrix is allocated and G can also
+    be an ``eclust.LowRankKernel``, an ``eclust.SparseKernel`` or a memory
+    mapped matrix, which is read in blocks of rows. 'auto' uses 'dense' for
+    small in-memory problems and 'arpack' otherwise. The residuals
+    |L u - lambda u| of 'lobpcg' are checked, and if any is above
+    LOBPCG_TOL (relative to |lambda| when larger than 1) a warning is
+    issued and 'arpack' is used instead.
+
+    Return the eigenvectors Y, normalized as Y^T D Y = I, and the degrees d.
+    Raise ValueError if some degree is not positive.
+    
+    """
+    n, _ = G.shape
+    w = eclust.weights(W, n)
+    w2 = np.sqrt(w)
+    wg = w*G.diagonal()
+    d = w2*eclust.kernel_dot(G, w2) - wg
+    if not (d > 0).all():
+        raise ValueError("The degrees must be positive, but %i of them are "
+                         "not." % (~(d > 0)).sum())
+    d2 = 1/np.sqrt(d)
+    if solver == 'auto':
+        small = n <= 2000 and type(G) is np.ndarray
+        solver = 'dense' if small else 'arpack'
+    
+    if solver == 'dense':
+        if not isinstance(G, np.ndarray):
+            G = G.toarray()
+        L = G*(w2*d2)[np.newaxis,:]
+        L *= (w2*d2)[:,np.newaxis]
+        np.fill_diagonal(L, 0)
+        eigvals, U = eigh(L, eigvals=(n-k,n-1))
+    else:
+        a = (w2*d2)[:,np.newaxis]
+        b = (wg*d2*d2)[:,np.newaxis]
+        matmat = lambda U: a*eclust.kernel_dot(G, a*U) - b*U
+        matvec = lambda u: matmat(u.reshape(-1, 1)).ravel()
+        if solver == 'lobpcg':
+            L = LinearOperator((n, n), matvec=matvec, matmat=matmat,
+                               dtype=float)
+            U0 = np.random.normal(size=(n, k))
+            eigvals, U = lobpcg(L, U0, largest=True, tol=1e-8, maxiter=500)
+            res = np.linalg.norm(matmat(U) - U*eigvals, axis=0)
+            if (res > LOBPCG_TOL*np.maximum(1, np.abs(eigvals))).any():
+                warnings.warn("lobpcg did not converge (largest residual "
+                              "%g); falling back to arpack." % res.max())
+                solver = 'arpack'
+        if solver == 'arpack':
+            L = LinearOperator((n, n), matvec=matvec, dtype=float)
+            eigvals, U = eigsh(L, k, which='LA')
+        elif solver != 'lobpcg':
+            raise ValueError("Unknown eigen solver '%s'." % solver)
+        order = np.argsort(eigvals)
+        U = U[:,order]
+    
+    return d2[:,np.newaxis]*U, d
+
+def topeigen(k, G, W=None, run_times=1, init='k-means++', solver='auto'):
     """This is similar to the spectral clustering proposed by
     Ng, Jordan, and Weiss, however numerically it seems to be a little better
     and more stable.
     In this case we are effectivelly solving the eigenvalue problem
     for the matrix G D^{-1}, where G has diagonals set to zero.
+    See ``top_eigenvectors`` for the solver.
     
     """
-    K = np.copy(G)
-    n, _ = K.shape
-    W2 = np.sqrt(W)
-    K = W2.dot(K.dot(W2))
-    for i in range(n):
-        K[i,i] = 0
-    D = np.diag(K.sum(axis=1))
-    
-    eigvals, Y = eigh(K, D, eigvals=(n-k,n-1))
-    Yt = np.array([D.dot(Y[:,i]) for i in range(Y.shape[1])]).T
+    Y, d = top_eigenvectors(k, G, W, solver)
+    Yt = d[:,np.newaxis]*Y
     
     for i in range(k):
         Yt[i] = Yt[i]/np.linalg.norm(Yt[i])
@@ -103,22 +193,14 @@ def topeigen(k, G, W, run_times=1, init='k-means++'):
     labels = km.fit_predict(Yt)
     return labels
 
-def topeigen2(k, G, W, run_times=1, init='k-means++'):
+def topeigen2(k, G, W=None, run_times=1, init='k-means++', solver='auto'):
     """This is similar to the spectral clustering proposed by
     Ng, Jordan, and Weiss.
     In this case we are effectivelly solving the eigenvalue problem
     for the matrix D^{-1}G, where G has diagonals set to zero.
     
     """
-    K = np.copy(G)
-    n, _ = K.shape
-    W2 = np.sqrt(W)
-    K = W2.dot(K.dot(W2))
-    for i in range(n):
-        K[i,i] = 0
-    D = np.diag(K.sum(axis=1))
-    
-    eigvals, Yt = eigh(K, D, eigvals=(n-k,n-1))
+    Yt, d = top_eigenvectors(k, G, W, solver)
     
     for i in range(k):
         Yt[i] = Yt[i]/np.linalg.norm(Yt[i])
@@ -127,24 +209,15 @@ def topeigen2(k, G, W, run_times=1, init='k-means++'):
     labels = km.fit_predict(Yt)
     return labels
 
-def spectralNg(k, G, W, run_times=1, init='k-means++'):
+def spectralNg(k, G, W=None, run_times=1, init='k-means++', solver='auto'):
     """This is spectral clustering proposed by
     Ng, Jordan, and Weiss.
     It considers the eigenvalue problem
     for the matrix D^{-1/2} G D^{-1/2}, where G has diagonals set to zero.
     
     """
-    K = np.copy(G)
-    n, _ = K.shape
-    W2 = np.sqrt(W)
-    K = W2.dot(K.dot(W2))
-    for i in range(n):
-        K[i,i] = 0
-    D = np.diag(K.sum(axis=1))
-    D2 = np.power(D, 0.5)
-    
-    eigvals, Y = eigh(K, D, eigvals=(n-k,n-1))
-    Yt = np.array([D2.dot(Y[:,i]) for i in range(Y.shape[1])]).T
+    Y, d = top_eigenvectors(k, G, W, solver)
+    Yt = np.sqrt(d)[:,np.newaxis]*Y
     
     for i in range(k):
         Yt[i] = Yt[i]/np.linalg.norm(Yt[i])
@@ -153,11 +226,10 @@ def spectralNg(k, G, W, run_times=1, init='k-means++'):
     labels = km.fit_predict(Yt)
     return labels
 
-def spectral(k, G, W):
+def spectral(k, G, W=None):
     """Spectral clustering from standard sklearn library."""
     n = G.shape[0]
-    W2 = np.sqrt(W)
-    Gtilde = W2.dot(G.dot(W2))
+    Gtilde = eclust.weighted_kernel(G, np.sqrt(eclust.weights(W, n)))
     sc = SpectralClustering(k, affinity='precomputed')
     labels = sc.fit_predict(Gtilde)
     return labels
@@ -171,7 +243,6 @@ if __name__ == "__main__":
     from prettytable import PrettyTable 
     
     import data
-    import eclust
     import metric
 
     table = []
@@ -188,8 +259,8 @@ if __name__ == "__main__":
         X, z = data.multivariate_normal([m1, m2], [s1, s2], [n1, n2])
         k = 2
         G = eclust.kernel_matrix(X, 
-                        lambda x, y: np.power(np.linalg.norm(x-y),1))
-        W = np.eye(n1+n2)
+                        eclust.Semimetric('power', 1))
+        W = np.ones(n1+n2)
         
         results = []
         
@@ -29,7 +29,7 @@ Y = np.array([[x] for x in X])
 
 ### clustering
 t = PrettyTable(['Method', 'Accuracy'])
-G = eclust.kernel_matrix(Y, lambda x, y: np.linalg.norm(x-y))
+G = eclust.kernel_matrix(Y, eclust.Semimetric('power', 1))
 zh_kmeans = wrapper.kmeans(k, Y)
 t.add_row(['k-means', metric.accuracy(z, zh_kmeans)])
 zh_gmm = wrapper.gmm(k, Y)
@@ -0,0 +1,164 @@
+"""Mini-batch kernel k-groups for data too large to hold the kernel matrix.
+
+The kernel is never formed. A fixed reservoir of m representatives gives
+Nystrom features phi(x) = K(x, L) K(L, L)^{-1/2}, computed on demand for
+each batch, and each cluster is summarized by its weighted centroid in this
+feature space and by its weight. Memory is O(m^2 + km) besides the data.
+
+"""
+
+# Guilherme Franca <guifranca@gmail.com>
+# Johns Hopkins University
+
+from __future__ import division
+
+import numpy as np
+
+import eclust
+import init
+import nystrom
+
+
+def _join_costs(F, M, sizes, w):
+    """Cost w s_l/(s_l+w) |phi-mu_l|^2 of adding each row of F to each
+    cluster, as in a Hartigan move of kernel k-groups."""
+    D = F.dot(M.T)
+    D *= -2
+    D += (F**2).sum(axis=1)[:,np.newaxis]
+    D += (M**2).sum(axis=1)
+    np.maximum(D, 0, out=D)
+    return D*(w[:,np.newaxis]*sizes/(sizes + w[:,np.newaxis]))
+
+def minibatch_kgroups(k, X, rho, x0=None, W=None, batch_size=1000,
+                      n_landmarks=200, landmarks='uniform', max_iter=1000,
+                      tol=1e-4, patience=10, verbose=False,
+                      return_objective=False):
+    """Approximate kernel k-groups on X with semimetric rho, by mini-batches.
+
+    At each step batch_size points are sampled and their kernel rows with
+    the n_landmarks representatives (chosen by ``nystrom.landmarks``) are
+    computed. Each point goes to the cluster of smallest Hartigan cost,
+    where its current cluster is charged the gain of leaving it, and the
+    centroids move towards the batch means with learning rate equal to the
+    weight of the new points over all the weight the cluster has received,
+    as in mini-batch k-means. Cluster weights are estimated from the
+    fraction of all assignments made so far.
+
+    Stop when the objective sum_l s_l |mu_l|^2 changes by less than tol,
+    relatively, for patience consecutive steps, or after max_iter steps.
+    All points are then labeled in batches. Return the labels and, if
+    return_objective, the objective of the final labels under the Nystrom
+    approximation.
+
+    """
+    n = X.shape[0]
+    w = eclust.weights(W, n)
+    total = w.sum()
+    idx = nystrom.landmarks(n_landmarks, X, rho, x0, landmarks)
+    XL = X[idx]
+    T = nystrom.projection(XL, rho, x0)
+    features = lambda A: eclust.kernel_matrix(A, rho, x0, Y=XL).dot(T)
+
+    # seeding with k-means++ on the features of a first batch
+    b = np.random.choice(n, min(n, batch_size), replace=False)
+    F = features(X[b])
+    zb, C = init._kmeans_plus(k, F)
+    counts = np.bincount(zb, weights=w[b], minlength=k)
+    M = F[C]
+    nonempty = counts > 0
+    M[nonempty] = np.asarray(eclust._onehot(zb, k, w[b]).T.dot(F))[nonempty]
+    M[nonempty] /= counts[nonempty,np.newaxis]
+    z = -np.ones(n, dtype=np.int32) # last cluster of each sampled point
+    z[b] = zb
+
+    obj = np.inf
+    flat = 0
+    count = 0
+    while flat < patience and count < max_iter:
+        b = np.random.randint(0, n, batch_size)
+        F = features(X[b])
+        sizes = total*counts/counts.sum()
+        costs = _join_costs(F, M, sizes, w[b])
+        # staying in the current cluster costs the gain of leaving it
+        seen = np.where(z[b] >= 0)[0]
+        j = z[b[seen]]
+        stay = np.maximum(sizes[j] - w[b[seen]], 1e-12)
+        costs[seen,j] *= (sizes[j] + w[b[seen]])/stay
+        zb = np.argmin(costs, axis=1).astype(np.int32)
+        z[b] = zb
+
+        # damped update of the centroids towards the batch means
+        batch_w = np.bincount(zb, weights=w[b], minlength=k)
+        S = np.asarray(eclust._onehot(zb, k, w[b]).T.dot(F))
+        counts += batch_w
+        hit = batch_w > 0
+        eta = batch_w[hit]/counts[hit]
+        M[hit] = (1-eta)[:,np.newaxis]*M[hit] + \
+                 eta[:,np.newaxis]*S[hit]/batch_w[hit,np.newaxis]
+
+        new_obj = (total*counts/counts.sum()*(M**2).sum(axis=1)).sum()
+        if abs(new_obj - obj) < tol*abs(new_obj):
+            flat += 1
+        else:
+            flat = 0
+        obj = new_obj
+        count += 1
+
+    if verbose:
+        if count >= max_iter:
+            print "\tMini-batch k-groups didn't converge in %i steps." % count
+        else:
+            print "\tMini-batch k-groups converged in %i steps." % count
+
+    # label all points, in batches
+    sizes = total*counts/counts.sum()
+    S = np.zeros_like(M)
+    for a in range(0, n, batch_size):
+        F = features(X[a:a+batch_size])
+        z[a:a+batch_size] = np.argmin(_join_costs(F, M, sizes,
+                                                  w[a:a+batch_size]), axis=1)
+        S += np.asarray(eclust._onehot(z[a:a+batch_size], k,
+                                       w[a:a+batch_size]).T.dot(F))
+    if return_objective:
+        s = np.bincount(z, weights=w, minlength=k)
+        return z, eclust.objective_stats((S**2).sum(axis=1), s)
+    return z
+
+
+###############################################################################
+if __name__ == '__main__':
+
+    from timeit import default_timer as timer
+    from prettytable import PrettyTable
+
+    import data
+    import metric
+
+    D = 10
+    n = 100000
+    m1 = np.zeros(D)
+    m2 = np.concatenate((np.ones(5), np.zeros(D-5)))
+    X, z = data.multivariate_normal([m1, m2], [np.eye(D), np.eye(D)],
+                                    [n, n])
+    k = 2
+    rho = eclust.Semimetric('power', 1)
+
+    t = PrettyTable(["Method", "Accuracy", "Objective", "Exec Time"])
+
+    for batch_size in [100, 1000]:
+        start = timer()
+        zh, obj = minibatch_kgroups(k, X, rho, batch_size=batch_size,
+                                    verbose=True, return_objective=True)
+        end = timer()
+        t.add_row(["mini-batch k-groups, b=%i" % batch_size,
+                   metric.accuracy(z, zh), obj, end-start])
+
+    start = timer()
+    G, _ = nystrom.nystrom(X, rho, 200)
+    zh, obj = eclust.kernel_kgroups(k, G, init.kmeans_plus(k, X),
+                                    return_objective=True)
+    end = timer()
+    t.add_row(["kernel k-groups, Nystrom m=200", metric.accuracy(z, zh),
+               obj, end-start])
+
+    print t
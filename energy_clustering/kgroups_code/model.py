@@ -0,0 +1,280 @@
+"""Fitted energy statistics clustering, able to label new points."""
+
+# Guilherme Franca <guifranca@gmail.com>
+# Johns Hopkins University
+
+from __future__ import division
+
+import numpy as np
+from sklearn.base import BaseEstimator, ClusterMixin
+from sklearn.utils import check_random_state
+
+import eclust
+import init
+import nystrom
+import wrapper
+
+
+def _diagonal(X, rho, x0=None):
+    """G(x, x) = rho(x, x0) for the rows of X."""
+    if isinstance(rho, eclust.Semimetric):
+        x0 = np.zeros(X.shape[1]) if x0 is None else x0
+        return rho.pairwise(X, np.asarray(x0, dtype=float).reshape(1, -1))[:,0]
+    return np.array([eclust.kernel_function(x, x, rho, x0) for x in X])
+
+def _affinities(X, X_fit, coef, rho, x0=None):
+    """Affinities K(X, X_fit) coef of the rows of X with the clusters,
+    computed in blocks of rows so only a block of K is held at a time."""
+    Q = np.empty((X.shape[0], coef.shape[1]))
+    step = max(1, eclust.TILE_BYTES//(8*len(X_fit)))
+    for a in range(0, X.shape[0], step):
+        K = eclust.kernel_matrix(X[a:a+step], rho, x0, Y=X_fit)
+        Q[a:a+step] = np.asarray(coef.T.dot(K.T)).T
+    return Q
+
+def _assign(q, s, Q, g=None, method='kgroups'):
+    """Label points with affinities Q (m x k) with clusters of costs q and
+    sums of weights s, by the Hartigan join cost of kernel k-groups, or by
+    the kernel k-means rule if method='kmeans' or g, the kernel of each
+    point with itself, is not given. Empty clusters are never chosen.
+
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if method == 'kmeans' or g is None:
+            costs = q/(s**2) - 2*Q/s
+        else:
+            costs = (q/s - 2*Q - np.asarray(g)[:,np.newaxis])/(s + 1)
+    costs[:,s == 0] = np.inf
+    return np.argmin(costs, axis=1).astype(np.int32)
+
+class KGroupsModel(object):
+    """Kernel k-groups (or kernel k-means if method='kmeans') with semimetric
+    rho, which keeps what is needed to label new points: the sum of weights
+    s_l and the cost q_l of each cluster, and either the weighted training
+    points or, if landmarks is an integer L, only L landmarks and the
+    affinities of each cluster with them.
+
+    A new point x joins the cluster that a Hartigan move would choose,
+    i.e. the one minimizing (q_l/s_l - 2 Q_l(x) - G(x,x))/(s_l + 1), where
+    Q_l(x) = sum_{j in C_l} w_j G(x, x_j). With the training points this
+    costs O(n) per point; with landmarks Q_l(x) is taken from the Nystrom
+    features of x and costs O(Lk). In that case q_l and G(x,x) are also
+    taken from the Nystrom approximation, so that the join cost is that of
+    a single kernel.
+
+    """
+
+    def __init__(self, k, rho, x0=None, method='kgroups', landmarks=None):
+        self.k = k
+        self.rho = rho
+        self.x0 = x0
+        self.method = method
+        self.landmarks = landmarks
+
+    def fit(self, X, z0=None, W=None, G=None, **kwargs):
+        """Cluster X starting from labels z0 (k-means++ if None). G is the
+        kernel matrix of X if already computed. Other arguments are passed
+        to the optimizer. Return self.
+
+        """
+        X = np.asarray(X, dtype=float)
+        n = X.shape[0]
+        if G is None:
+            G = eclust.kernel_matrix(X, self.rho, self.x0)
+        if z0 is None:
+            z0 = init.kmeans_plus(self.k, X)
+        optimizer = getattr(eclust, "kernel_%s" % self.method)
+        self.labels_, self.objective_ = optimizer(self.k, G, z0, W,
+                                                  return_objective=True,
+                                                  **kwargs)
+        self.q_, self.s_ = eclust.cluster_stats(self.labels_, G, W, self.k)
+        w = eclust.weights(W, n)
+        Zw = eclust._onehot(self.labels_, self.k, w)
+        # Q(x) = K(x, X_) coef_
+        if self.landmarks is None:
+            self.X_ = X
+            self.coef_ = Zw
+        else:
+            idx = nystrom.landmarks(self.landmarks, X, self.rho, self.x0)
+            self.X_ = X[idx]
+            T = nystrom.projection(self.X_, self.rho, self.x0)
+            # Q(x) ~ K(x, L) T T^T Phi^T Zw, with Phi = K(X, L) T
+            Phi = eclust.kernel_matrix(X, self.rho, self.x0, Y=self.X_).dot(T)
+            C = np.asarray(Zw.T.dot(Phi))
+            self.q_ = (C**2).sum(axis=1)
+            self.coef_ = T.dot(C.T)
+            self.T_ = T
+        return self
+
+    def fit_predict(self, X, z0=None, W=None, G=None, **kwargs):
+        return self.fit(X, z0, W, G, **kwargs).labels_
+
+    def affinities(self, X):
+        """Return the m x k affinities Q_l(x) of the rows of X with the
+        clusters, computed in blocks of rows."""
+        X = np.asarray(X, dtype=float)
+        return _affinities(X, self.X_, self.coef_, self.rho, self.x0)
+
+    def predict(self, X):
+        """Label the rows of X with the fitted clusters."""
+        X = np.asarray(X, dtype=float)
+        if self.landmarks is None:
+            g = _diagonal(X, self.rho, self.x0)
+        else:
+            F = eclust.kernel_matrix(X, self.rho, self.x0, Y=self.X_)
+            g = (F.dot(self.T_)**2).sum(axis=1)
+        return _assign(self.q_, self.s_, self.affinities(X), g, self.method)
+
+class KernelKGroups(BaseEstimator, ClusterMixin):
+    """scikit-learn estimator for kernel k-groups, or kernel k-means if
+    method='kmeans'.
+
+    metric is 'precomputed', in which case X is the kernel matrix, or the
+    kind of an ``eclust.Semimetric`` ('power', 'exp' or 'gauss') with
+    parameter metric_param, and x0 the base point of the kernel. init is
+    one of the initializations of ``wrapper.initialize``, n_init the number
+    of restarts, run in n_jobs processes, and the best objective is kept.
+    With warm_start a new fit on data of the same size starts from the
+    previous labels instead. partial_fit adds new points to the fitted
+    partition without refitting.
+
+    Attributes are labels_, objective_, and the costs q_ and sums of
+    weights s_ of each cluster, used by predict and partial_fit.
+
+    """
+
+    def __init__(self, n_clusters=8, metric='power', metric_param=1, x0=None,
+                 method='kgroups', init='k-means++', n_init=5, n_jobs=1,
+                 max_iter=300, tol=1e-4, warm_start=False, random_state=None):
+        self.n_clusters = n_clusters
+        self.metric = metric
+        self.metric_param = metric_param
+        self.x0 = x0
+        self.method = method
+        self.init = init
+        self.n_init = n_init
+        self.n_jobs = n_jobs
+        self.max_iter = max_iter
+        self.tol = tol
+        self.warm_start = warm_start
+        self.random_state = random_state
+
+    @property
+    def _pairwise(self):
+        return self.metric == 'precomputed'
+
+    def _rho(self):
+        return eclust.Semimetric(self.metric, self.metric_param)
+
+    def fit(self, X, y=None, sample_weight=None):
+        X = np.asarray(X, dtype=float)
+        k = self.n_clusters
+        if self.metric == 'precomputed':
+            G, X_fit = X, None
+        else:
+            G, X_fit = eclust.kernel_matrix(X, self._rho(), self.x0), X
+
+        if self.warm_start and len(getattr(self, 'labels_', [])) == len(G):
+            optimizer = getattr(eclust, "kernel_%s" % self.method)
+            z, obj = optimizer(k, G, self.labels_, sample_weight,
+                               max_iter=self.max_iter, tol=self.tol,
+                               return_objective=True)
+        else:
+            seed = None
+            if self.random_state is not None:
+                seed = check_random_state(self.random_state).randint(2**31-1)
+            z, obj, _, _ = wrapper.restarts(self.method, k, X_fit, G,
+                                            sample_weight, self.n_init,
+                                            self.init, self.n_jobs, seed,
+                                            self.max_iter, self.tol)
+
+        self.labels_ = np.asarray(z, dtype=np.int32)
+        self.objective_ = obj
+        self.q_, self.s_ = eclust.cluster_stats(self.labels_, G,
+                                                sample_weight, k)
+        self.X_fit_ = X_fit
+        self.sample_weight_ = eclust.weights(sample_weight, len(G))
+        return self
+
+    def _affinities(self, X):
+        """Affinities of the rows of X with the clusters, in blocks."""
+        Zw = eclust._onehot(self.labels_, self.n_clusters, self.sample_weight_)
+        if self.metric == 'precomputed':
+            return np.asarray(Zw.T.dot(X.T)).T
+        return _affinities(X, self.X_fit_, Zw, self._rho(), self.x0)
+
+    def predict(self, X, diagonal=None):
+        """Label new points. With metric='precomputed' X is their kernel
+        with the training points, and diagonal their kernel with
+        themselves; without it the kernel k-means rule is used.
+
+        """
+        X = np.asarray(X, dtype=float)
+        g = diagonal
+        if self.metric != 'precomputed':
+            g = _diagonal(X, self._rho(), self.x0)
+        return _assign(self.q_, self.s_, self._affinities(X), g,
+                       self.method)
+
+    def partial_fit(self, X, y=None, sample_weight=None):
+        """Add the points X to the fitted partition: each one joins the
+        cluster chosen by predict, and the costs and sums of weights are
+        updated exactly, including the kernel among the new points. Fit X
+        if nothing was fitted yet.
+
+        """
+        if not hasattr(self, 'labels_'):
+            return self.fit(X, sample_weight=sample_weight)
+        if self.metric == 'precomputed':
+            raise ValueError("partial_fit needs a semimetric, not "
+                             "metric='precomputed'.")
+        X = np.asarray(X, dtype=float)
+        m = X.shape[0]
+        w = eclust.weights(sample_weight, m)
+        Q = self._affinities(X)
+        z = _assign(self.q_, self.s_, Q, _diagonal(X, self._rho(), self.x0),
+                    self.method)
+
+        k = self.n_clusters
+        q_new, s_new = eclust.cluster_stats(z, eclust.kernel_matrix(X,
+                                            self._rho(), self.x0), w, k)
+        self.q_ = self.q_ + q_new + \
+                  2*np.bincount(z, weights=w*Q[np.arange(m), z], minlength=k)
+        self.s_ = self.s_ + s_new
+        self.objective_ = eclust.objective_stats(self.q_, self.s_)
+        self.labels_ = np.concatenate((self.labels_, z))
+        self.X_fit_ = np.concatenate((self.X_fit_, X))
+        self.sample_weight_ = np.concatenate((self.sample_weight_, w))
+        return self
+
+
+###############################################################################
+if __name__ == '__main__':
+
+    from timeit import default_timer as timer
+    from prettytable import PrettyTable
+
+    import data
+    import metric
+
+    D = 10
+    m1 = np.zeros(D)
+    m2 = np.concatenate((np.ones(5), np.zeros(D-5)))
+    X, z = data.multivariate_normal([m1, m2], [np.eye(D), np.eye(D)],
+                                    [1000, 1000])
+    Y, zy = data.multivariate_normal([m1, m2], [np.eye(D), np.eye(D)],
+                                     [10000, 10000])
+    k = 2
+    rho = eclust.Semimetric('power', 1)
+
+    t = PrettyTable(["Model", "Train accuracy", "Test accuracy",
+                     "Predict Time"])
+    for landmarks in [None, 100]:
+        model = KGroupsModel(k, rho, landmarks=landmarks).fit(X)
+        start = timer()
+        zh = model.predict(Y)
+        end = timer()
+        t.add_row(["landmarks=%s" % landmarks,
+                   metric.accuracy(z, model.labels_),
+                   metric.accuracy(zy, zh), end-start])
+    print t
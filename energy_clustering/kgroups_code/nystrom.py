@@ -0,0 +1,141 @@
+"""Nystrom low rank approximation of energy statistics kernels.
+
+With m landmark points L the kernel matrix is approximated by
+G ~ C W^+ C^T, where C = K(X, L) is n x m and W = K(L, L). We keep the
+factor Phi = C W^{-1/2}, so that G ~ Phi Phi^T, and wrap it in an
+``eclust.LowRankKernel`` which the optimizers and initializers accept in
+place of G. Memory is O(nm) and a sweep of kernel k-groups costs O(nmk).
+
+"""
+
+# Guilherme Franca <guifranca@gmail.com>
+# Johns Hopkins University
+
+from __future__ import division
+
+import numpy as np
+from scipy.linalg import eigh
+
+import eclust
+import init
+
+
+def projection(XL, rho, x0=None, tol=1e-10):
+    """Return the m x r matrix T = K(L, L)^{-1/2} for landmarks XL, so the
+    Nystrom features of any points X are K(X, L) T. Eigenvalues of K(L, L)
+    below tol times the largest are dropped, so r <= m.
+
+    """
+    lam, U = eigh(eclust.kernel_matrix(XL, rho, x0))
+    keep = lam > tol*lam.max()
+    return U[:,keep]/np.sqrt(lam[keep])
+
+def factor(X, rho, idx, x0=None, tol=1e-10):
+    """Return the n x r Nystrom factor Phi of the kernel with semimetric rho
+    and landmarks X[idx]. See ``projection``.
+
+    """
+    T = projection(X[idx], rho, x0, tol)
+    return eclust.kernel_matrix(X, rho, x0, Y=X[idx]).dot(T)
+
+def landmarks(m, X, rho=None, x0=None, method='uniform'):
+    """Choose m landmark indices. method='uniform' samples them without
+    replacement, 'k-means++' uses k-means++ seeding on X, and 'leverage'
+    samples proportional to the rank m leverage scores of a uniform pilot
+    factor with 2m landmarks (rho is needed in this case).
+
+    """
+    n = X.shape[0]
+    if method == 'uniform':
+        idx = np.random.choice(n, m, replace=False)
+    elif method == 'k-means++':
+        _, idx = init._kmeans_plus(m, X)
+    elif method == 'leverage':
+        pilot = np.random.choice(n, min(n, 2*m), replace=False)
+        U, _, _ = np.linalg.svd(factor(X, rho, pilot, x0), full_matrices=False)
+        lev = (U[:,:m]**2).sum(axis=1)
+        p = lev + 1e-12*lev.max()
+        idx = np.random.choice(n, m, replace=False, p=p/p.sum())
+    else:
+        raise ValueError("Unknown landmark method '%s'." % method)
+    return np.sort(idx)
+
+def nystrom(X, rho, m, x0=None, method='uniform'):
+    """Nystrom approximation of kernel_matrix(X, rho, x0) with m landmarks
+    chosen by ``landmarks``. Return an ``eclust.LowRankKernel`` and the
+    landmark indices.
+
+    """
+    idx = landmarks(m, X, rho, x0, method)
+    return eclust.LowRankKernel(factor(X, rho, idx, x0)), idx
+
+def _block(G, S):
+    """The block G[S][:,S], formed or read only on S."""
+    if isinstance(G, eclust.LowRankKernel):
+        Phi = G.Phi[S]
+        return Phi.dot(Phi.T)
+    if isinstance(G, eclust.SparseKernel):
+        u = G.u[S]
+        v = G.v[S]
+        return G.B[S][:,S].toarray() + np.outer(u, v) + np.outer(v, u)
+    return np.asarray(G[np.ix_(S, S)]) # reads only the sampled columns
+
+def approximation_error(X, rho, G, x0=None, n_samples=1000):
+    """Estimate the error of the approximation G of kernel_matrix(X, rho, x0)
+    on the block of n_samples random points, without forming the n x n
+    kernel. Return the relative Frobenius and trace errors on that block.
+    For a Nystrom ``eclust.LowRankKernel`` the trace error is nonnegative,
+    since it is obtained by projection; this need not hold for other
+    approximations, such as an ``eclust.SparseKernel``.
+
+    """
+    n = X.shape[0]
+    S = np.sort(np.random.choice(n, min(n, n_samples), replace=False))
+    K = eclust.kernel_matrix(X[S], rho, x0)
+    Kt = _block(G, S)
+    frob = np.linalg.norm(K - Kt)/np.linalg.norm(K)
+    trace = (np.trace(K) - np.trace(Kt))/np.trace(K)
+    return frob, trace
+
+
+###############################################################################
+if __name__ == '__main__':
+
+    from timeit import default_timer as timer
+    from prettytable import PrettyTable
+
+    import data
+    import metric
+
+    D = 10
+    n = 2000
+    m1 = np.zeros(D)
+    m2 = np.concatenate((np.ones(5), np.zeros(D-5)))
+    X, z = data.multivariate_normal([m1, m2], [np.eye(D), np.eye(D)],
+                                    [n, n])
+    k = 2
+    rho = eclust.Semimetric('power', 1)
+
+    t = PrettyTable(["Kernel", "Frobenius error", "Trace error",
+                     "Accuracy", "Objective", "Exec Time"])
+
+    start = timer()
+    G = eclust.kernel_matrix(X, rho)
+    z0 = init.kmeans_plus(k, X)
+    zh = eclust.kernel_kgroups(k, G, z0)
+    end = timer()
+    t.add_row(["full", 0, 0, metric.accuracy(z, zh),
+               eclust.objective(zh, G), end-start])
+
+    for method in ['uniform', 'k-means++', 'leverage']:
+        for m in [20, 100]:
+            start = timer()
+            Gm, _ = nystrom(X, rho, m, method=method)
+            zh = eclust.kernel_kgroups(k, Gm, z0)
+            end = timer()
+            frob, trace = approximation_error(X, rho, Gm)
+            t.add_row(["%s, m=%i" % (method, m), frob, trace,
+                       metric.accuracy(z, zh), eclust.objective(zh, G),
+                       end-start])
+
+    print t
@@ -22,8 +22,8 @@ import metric
 import sys
 
 # some semmimetric functions
-rho = lambda x, y: np.power(np.linalg.norm(x-y), 0.5)
-rho1 = lambda x, y: np.linalg.norm(x-y)
+rho = eclust.Semimetric('power', 0.5)
+rho1 = eclust.Semimetric('power', 1)
 
 img = cv2.imread('data/Tsunami_by_hokusai_19th_century.jpg')
 r = 100 / img.shape[1]
@@ -51,8 +51,8 @@ sigma2 = sum([np.linalg.norm(x-y)**2
                 for x in data for y in data])/(len(data)**2)
 sigma = np.sqrt(sigma2)
 
-rho_exp = lambda x, y: 2-2*np.exp(-np.linalg.norm(x-y)/(2*sigma))
-rho_gauss = lambda x, y: 2-2*np.exp(-np.linalg.norm(x-y)**2/(2*(sigma)**2))
+rho_exp = eclust.Semimetric('exp', sigma)
+rho_gauss = eclust.Semimetric('gauss', sigma)
 
 G = eclust.kernel_matrix(data, rho)
 #G = eclust.kernel_matrix(data, rho_gauss)
@@ -17,10 +17,10 @@ import metric
 import sys
 
 # some semmimetric functions
-rho = lambda x, y: np.power(np.linalg.norm(x-y), 0.5)
-rho1 = lambda x, y: np.linalg.norm(x-y)
+rho = eclust.Semimetric('power', 0.5)
+rho1 = eclust.Semimetric('power', 1)
 rho_exp = lambda x, y: 2-2*np.exp(-np.linalg.norm(x-y)/(2*sigma))
-rho_gauss = lambda x, y: 2-2*np.exp(-np.linalg.norm(x-y)**2/(2*(1)**2))
+rho_gauss = eclust.Semimetric('gauss', 1)
 
 #df = pd.read_csv('data/wdbc.data', sep=',', header=None)
 #df = pd.read_csv('data/iris.data', sep=',', header=None)
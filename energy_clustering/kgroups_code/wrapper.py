@@ -5,6 +5,12 @@
 
 from __future__ import division
 
+import os
+import shutil
+import tempfile
+import multiprocessing as mp
+from timeit import default_timer as timer
+
 import numpy as np
 from sklearn.cluster import KMeans
 from sklearn.mixture import GaussianMixture as GMM
@@ -15,54 +21,112 @@ import metric
 import eclust
 
 def initialize(method, k, G, X, W):
+    """Initial labels by "spectral", "k-means++" (in the kernel feature
+    space when X is None), "kernel k-means++", or random otherwise.
+    
+    """
     if method == "spectral":
         z0 = init.topeigen(k, G, W)
-    elif method == "k-means++":
+    elif method == "k-means++" and X is not None:
         z0 = init.kmeans_plus(k, X)
+    elif method in ("k-means++", "kernel k-means++"):
+        z0 = init.kmeans_plus_kernel(k, G, W)
     else:
-        z0 = np.random.randint(0, k, len(X))
-    Z0 = eclust.ztoZ(z0)
-    return Z0
-
-def kernel_kmeans(k, X, G, W=None, run_times=5, ini="k-means++"):
-    if type(W) == type(None):
-        W = np.eye(len(X))
-    best_score = -np.inf
-    for _ in range(run_times):
-        Z0 = initialize(ini, k, G, X, W)
-        zh = eclust.kernel_kmeans(k, G, Z0, W, max_iter=300)
-        Zh = eclust.ztoZ(zh)
-        score = eclust.objective(Zh, G, W)
-        if score > best_score:
-            best_score = score
-            best_z = zh
+        z0 = np.random.randint(0, k, len(G))
+    return z0
+
+def _restart(method, k, G, X, W, ini, seed, run_times, max_iter=300,
+             tol=1e-4):
+    """Run one restart of the given method with its own random seed.
+    Return labels, objective function and execution time.
+    
+    """
+    start = timer()
+    np.random.seed(seed)
+    if method == "spectral":
+        zh = init.topeigen(k, G, W, run_times=run_times)
+        score = eclust.objective(zh, G, W)
+    else:
+        z0 = initialize(ini, k, G, X, W)
+        optimizer = getattr(eclust, "kernel_%s" % method)
+        zh, score = optimizer(k, G, z0, W, max_iter=max_iter, tol=tol,
+                              return_objective=True)
+    return zh, score, timer()-start
+
+# data shared with the worker processes, set by _init_worker
+_shared = {}
+
+def _init_worker(G, X, W):
+    if isinstance(G, str): # file with the dense kernel matrix
+        G = np.load(G, mmap_mode='r')
+    _shared['G'] = G
+    _shared['X'] = X
+    _shared['W'] = W
+
+def _restart_worker(args):
+    method, k, ini, seed, run_times, max_iter, tol = args
+    return _restart(method, k, _shared['G'], _shared['X'], _shared['W'],
+                    ini, seed, run_times, max_iter, tol)
+
+def restarts(method, k, X, G, W=None, run_times=5, ini="k-means++",
+             n_jobs=1, seed=None, max_iter=300, tol=1e-4):
+    """Run restarts of kernel k-groups, kernel k-means or spectral
+    ("kgroups", "kmeans" or "spectral") and keep the best objective.
+
+    Each restart gets its own seed, drawn from ``seed`` or from the global
+    numpy random state if it is None. With n_jobs > 1 the restarts run in a
+    process pool; a dense G is written once to a temporary file and memory
+    mapped by the workers instead of being pickled (a G already memory
+    mapped from a .npy file, as given by ``eclust.kernel_matrix_memmap``,
+    is used directly), while a low rank ``eclust.LowRankKernel`` is small
+    enough to be sent as it is.
+
+    max_iter and tol are passed to the optimizer. Return the best labels,
+    the best objective, and the objective and execution time of each
+    restart.
+
+    """
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    seeds = rng.randint(0, 2**31-1, run_times)
+    if n_jobs == 1:
+        results = [_restart(method, k, G, X, W, ini, s, run_times, max_iter,
+                            tol) for s in seeds]
+    else:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            G_shared = G
+            if isinstance(G, np.memmap) and G.filename.endswith('.npy'):
+                G_shared = G.filename
+            elif isinstance(G, np.ndarray):
+                G_shared = os.path.join(tmpdir, 'G.npy')
+                np.save(G_shared, G)
+            pool = mp.Pool(n_jobs, initializer=_init_worker,
+                           initargs=(G_shared, X, W))
+            try:
+                results = pool.map(_restart_worker,
+                                   [(method, k, ini, s, run_times,
+                                     max_iter, tol) for s in seeds])
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            shutil.rmtree(tmpdir)
+    scores = np.array([r[1] for r in results])
+    times = np.array([r[2] for r in results])
+    best = np.argmax(scores)
+    return results[best][0], scores[best], scores, times
+
+def kernel_kmeans(k, X, G, W=None, run_times=5, ini="k-means++", n_jobs=1):
+    best_z, _, _, _ = restarts("kmeans", k, X, G, W, run_times, ini, n_jobs)
     return best_z
 
-def kernel_kgroups(k, X, G, W=None, run_times=5, ini="k-means++"):
-    if type(W) == type(None):
-        W = np.eye(len(X))
-    best_score = -np.inf
-    for _ in range(run_times):
-        Z0 = initialize(ini, k, G, X, W)
-        zh = eclust.kernel_kgroups(k, G, Z0, W, max_iter=300)
-        Zh = eclust.ztoZ(zh)
-        score = eclust.objective(Zh, G, W)
-        if score > best_score:
-            best_score = score
-            best_z = zh
+def kernel_kgroups(k, X, G, W=None, run_times=5, ini="k-means++", n_jobs=1):
+    best_z, _, _, _ = restarts("kgroups", k, X, G, W, run_times, ini, n_jobs)
     return best_z
 
-def spectral(k, X, G, W=None, run_times=5):
-    if type(W) == type(None):
-        W = np.eye(len(X))
-    best_score = -np.inf
-    for _ in range(run_times):
-        zh = init.topeigen(k, G, W, run_times=run_times)
-        Zh = eclust.ztoZ(zh)
-        score = eclust.objective(Zh, G, W)
-        if score > best_score:
-            best_score = score
-            best_z = zh
+def spectral(k, X, G, W=None, run_times=5, n_jobs=1):
+    best_z, _, _, _ = restarts("spectral", k, X, G, W, run_times, 
+                               n_jobs=n_jobs)
     return best_z
 
 def kmeans(k, X, run_times=5):
@@ -79,10 +143,7 @@ def gmm(k, X, run_times=5):
     return zh
 
 def spectral_clustering(k, X, G, W=None, run_times=5):
-    if type(W) == type(None):
-        W = np.eye(len(X))
-    W2 = np.sqrt(W)
-    Gtilde = W2.dot(G.dot(W2))
+    Gtilde = eclust.weighted_kernel(G, np.sqrt(eclust.weights(W, len(G))))
     sc = SpectralClustering(k, affinity='precomputed', n_init=run_times)
     zh = sc.fit_predict(Gtilde)
     return zh
@@ -104,8 +165,8 @@ if __name__ == "__main__":
     s1 = s2 = np.eye(d)
     X, z = data.multivariate_normal([m1, m2], [s1, s2], [n1, n2])
 
-    G = eclust.kernel_matrix(X, lambda x, y: np.linalg.norm(x-y))
-    W = np.eye(n)
+    G = eclust.kernel_matrix(X, eclust.Semimetric('power', 1))
+    W = np.ones(n)
     k = 2
 
     t = PrettyTable(["Method", "Accuracy"])
@@ -22,8 +22,8 @@ import metric
 import sys
 
 # some semmimetric functions
-rho = lambda x, y: np.power(np.linalg.norm(x-y), 1.5)
-rho1 = lambda x, y: np.linalg.norm(x-y)
+rho = eclust.Semimetric('power', 1.5)
+rho1 = eclust.Semimetric('power', 1)
 
 
 # get dermatology data, last column are labels
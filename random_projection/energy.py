@@ -3,43 +3,91 @@ from __future__ import division
 
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy.spatial.distance import cdist
 
 
+def _rows(A):
+    """View A as a 2D array of samples along its last axis. Return it and
+    the shape of the batch."""
+    A = np.asarray(A, dtype=float)
+    return A.reshape(-1, A.shape[-1]), A.shape[:-1]
+
 def fast_mean(X, Y):
-    """We can compute the mean in O(n) in 1D for sorted X and Y."""
-    sx = 0
-    sy = 0
-    i = 1
-    j = 1
-    nx = len(X)
-    ny = len(Y)
+    """Energy mean g(X, Y), the mean of |x - y| over all pairs, in
+    O(n log n) with no Python loops. X and Y are merged by a stable sort
+    and each y is paired with the count and sum of the x below it. Several
+    samples can be stacked along the first axes of X and Y (with the same
+    batch shape), and the means of each pair are returned in an array of
+    that shape.
+
+    """
+    X, batch = _rows(X)
+    Y, _ = _rows(Y)
+    nx = X.shape[1]
+    ny = Y.shape[1]
+    Z = np.concatenate((X, Y), axis=1)
+    order = np.argsort(Z, axis=1, kind='mergesort')
+    Z = Z[np.arange(len(Z))[:,np.newaxis], order]
+    is_x = order < nx
+    Zx = np.where(is_x, Z, 0)
+    below = np.cumsum(is_x, axis=1) # number of x up to each position
+    sum_below = np.cumsum(Zx, axis=1)
+    # sum_x |x - y| = y(2 #{x <= y} - nx) + sum_x x - 2 sum_{x <= y} x
+    S = Z*(2*below - nx) + sum_below[:,-1:] - 2*sum_below
+    S[is_x] = 0
+    return (S.sum(axis=1)/(nx*ny)).reshape(batch)[()]
+
+def fast_within_mean(X):
+    """g(X, X) for X sorted along its last axis, in O(n). Batches are as
+    in fast_mean."""
+    X, batch = _rows(X)
+    n = X.shape[1]
+    g = 2*X.dot(2*np.arange(n) + 1 - n)/(n*n)
+    return g.reshape(batch)[()]
 
-    while i <= nx and j <= ny:
-        if X[i-1] <= Y[j-1]:
-            sx += ((j-1)-(ny-(j-1)))/ny*X[i-1]
-            i += 1
-        else:
-            sy += ((i-1)-(nx-(i-1)))/nx*Y[j-1]
-            j += 1
-    if i > nx:
-        sy += Y[j-1:ny].sum()
-    else:
-        sx += X[i-1:nx].sum()
-    return (sx/nx) + (sy/ny)
-            
 def fast_energy(X, Y):
-    #X = np.sort(A)
-    #Y = np.sort(B)
-    return 2*fast_mean(X,Y) - fast_mean(X,X) - fast_mean(Y,Y)
+    """Energy distance between X and Y, sorted along their last axis."""
+    return 2*fast_mean(X, Y) - fast_within_mean(X) - fast_within_mean(Y)
 
 def fastT(X, Y):
-    nx = len(X)
-    ny = len(Y)
+    nx = np.shape(X)[-1]
+    ny = np.shape(Y)[-1]
     return nx*ny/(nx+ny)*fast_energy(X, Y)
 
+def _prefix_dispersion(Y):
+    """sum_{i<j<m} (y_j - y_i) for rows sorted in increasing order, for
+    m = 1..n."""
+    S = np.cumsum(Y, axis=1)
+    D = Y*np.arange(Y.shape[1])
+    D[:,1:] -= S[:,:-1]
+    return np.cumsum(D, axis=1)
+
+def fastT_splits(Y):
+    """T statistic of every split of samples sorted along the last axis,
+    T[..., m-1] = fastT(Y[..., :m], Y[..., m:]) for m = 1..n-1, in O(n)
+    with no Python loops. It uses T = 2(total - within), with the within
+    dispersions of all prefixes and suffixes obtained by cumulative sums.
+    Batches are as in fast_mean.
+
+    """
+    Y, batch = _rows(Y)
+    n = Y.shape[1]
+    Y = Y - Y.mean(axis=1)[:,np.newaxis] # less round-off in the sums
+    left = _prefix_dispersion(Y)
+    right = _prefix_dispersion(-Y[:,::-1])
+    m = np.arange(1, n)
+    within = left[:,:-1]/m + right[:,-2::-1]/m[::-1]
+    T = 2*(left[:,-1:]/n - within)
+    return T.reshape(batch + (n-1,))
+
 def mean(X, Y):
     """Compute mean of X and Y. This is O(n^2)."""
-    return sum([np.linalg.norm(x-y) for x in X for y in Y])/len(X)/len(Y)
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    if X.ndim == 1:
+        X = X[:,np.newaxis]
+        Y = Y[:,np.newaxis]
+    return cdist(X, Y).mean()
 
 def energy(X, Y):
     return 2*mean(X,Y) - mean(X,X) - mean(Y,Y)
@@ -54,4 +102,8 @@ if __name__ == "__main__":
     X = np.random.normal(0,1,100)
     Y = np.random.normal(2,1,100)
     print T(X, Y)
-    print fastT(X, Y)
+    print fastT(np.sort(X), np.sort(Y))
+
+    # many pairs at once, e.g. the two halves of 1000 sorted projections
+    P = np.sort(np.random.normal(0, 1, (1000, 200)), axis=1)
+    print fastT(P[:,:100], P[:,100:]).max()
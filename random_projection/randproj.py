@@ -6,6 +6,8 @@ We test clustering using 1D random projections.
 
 from __future__ import division
 
+import multiprocessing as mp
+
 import numpy as np
 import matplotlib.pyplot as plt
 from sklearn import random_projection
@@ -75,22 +77,140 @@ def kmeans_multi_random(X, z, n=10):
             bestJ = J
     return bestz
 
-def energy_multi_random(X, z, n=10):
-    bestT = 0
-    for i in range(n):
-        Y = rand_projection(X).flatten()
-        idx = np.argsort(Y)
-        n = int(len(idx)/2)
-        zh = np.zeros(len(Y), dtype=np.int)
-        zh[idx[n:]] = 1
-        A = Y[idx[:n]]
-        B = Y[idx[n:]]
-        T = energy.fastT(A, B)
-        #T = energy.T(X[idx[:n]], X[idx[n:]])
-        if T > bestT:
-            bestT = T
-            bestz = zh
-    return bestz
+# data shared with the worker processes, set by _init_worker
+_shared = {}
+
+def _init_worker(X):
+    _shared['X'] = X
+
+def _directions(d, size, seed):
+    """d x size matrix of random unit directions."""
+    R = np.random.RandomState(seed).normal(0, 1, (d, size))
+    return R/np.linalg.norm(R, axis=0)
+
+def _best_splits(X, R):
+    """Best split of the projections of X on each column of R. Return the
+    T statistic and the size of the left cluster of each, and R.
+
+    """
+    Y = np.sort(R.T.dot(X.T), axis=1) # one GEMM, then sort each projection
+    T = energy.fastT_splits(Y)
+    m = np.argmax(T, axis=1)
+    return T[np.arange(R.shape[1]), m], m+1, R
+
+def _projection_splits(args):
+    """Best splits of a chunk of random directions."""
+    seed, size = args
+    X = _shared['X']
+    return _best_splits(X, _directions(X.shape[1], size, seed))
+
+def energy_projections(X, n_projections=100, chunk_size=32, n_jobs=1,
+                       seed=None, directions='random'):
+    """Two clusters from the best of n_projections random 1D projections.
+
+    The directions are drawn as d x chunk_size matrices of unit vectors
+    (normalized, so the statistics of different projections compare), and
+    each chunk is projected with a single matrix product. Every split of
+    every sorted projection is scored by its T statistic at once, with
+    ``energy.fastT_splits``, and the best split of the best projection is
+    kept. Chunks run in n_jobs processes; memory is O(n chunk_size) per
+    process besides X. Each chunk draws its directions from its own seed,
+    so the result depends on seed and chunk_size but not on n_jobs.
+
+    directions='pca' uses only the first principal direction of X, and
+    'mixed' adds it to the random ones.
+
+    Return the labels, the T statistic and the direction.
+
+    """
+    X = np.asarray(X, dtype=float)
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    chunks = []
+    if directions in ('random', 'mixed'):
+        chunks = [(rng.randint(0, 2**31-1), min(chunk_size, n_projections-a))
+                  for a in range(0, n_projections, chunk_size)]
+    elif directions != 'pca':
+        raise ValueError("Unknown directions '%s'." % directions)
+    if not chunks:
+        results = []
+    elif n_jobs == 1:
+        _init_worker(X)
+        try:
+            results = [_projection_splits(c) for c in chunks]
+        finally:
+            _shared.clear()
+    else:
+        pool = mp.Pool(n_jobs, initializer=_init_worker, initargs=(X,))
+        try:
+            results = pool.map(_projection_splits, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    if directions in ('pca', 'mixed'):
+        pca = decomposition.PCA(n_components=1).fit(X)
+        results.append(_best_splits(X, pca.components_.T))
+    T = np.concatenate([r[0] for r in results])
+    m = np.concatenate([r[1] for r in results])
+    R = np.hstack([r[2] for r in results])
+    best = np.argmax(T)
+    idx = np.argsort(X.dot(R[:,best]), kind='mergesort')
+    zh = np.zeros(len(X), dtype=int)
+    zh[idx[m[best]:]] = 1
+    return zh, T[best], R[:,best]
+
+def energy_multi_random(X, z, n=10, n_jobs=1):
+    zh, _, _ = energy_projections(X, n, n_jobs=n_jobs)
+    return zh
+
+def energy_bisecting(X, k, n_projections=100, directions='random',
+                     min_gain=0, chunk_size=32, n_jobs=1, seed=None):
+    """Divisive energy clustering in up to k clusters.
+
+    Every cluster gets a proposed split from ``energy_projections``, with
+    the given directions. A proposal is kept only if it explains at least
+    a fraction min_gain of the dispersion of its cluster along that
+    projection, and the kept one with the largest gain is split. The
+    gain is T/2, the decrease of the within dispersion along the chosen
+    projection. Only the two new clusters need new proposals, so each
+    split costs O(n n_projections) for the cluster it divides and no
+    kernel matrix is formed. Stop at k clusters or when no proposal is
+    kept. The best split of a single Gaussian explains about 0.41 of its
+    dispersion, so with min_gain=0.5 unimodal clusters are not split.
+
+    Return the labels and the gain of each split, in order.
+
+    """
+    X = np.asarray(X, dtype=float)
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    z = np.zeros(len(X), dtype=int)
+
+    def propose(l):
+        idx = np.flatnonzero(z == l)
+        if len(idx) < 2:
+            return None
+        zh, T, r = energy_projections(X[idx], n_projections, chunk_size,
+                                      n_jobs, rng.randint(0, 2**31-1),
+                                      directions)
+        y = np.sort(X[idx].dot(r))
+        total = len(y)/2*energy.fast_within_mean(y)
+        ratio = T/(2*total) if total > 0 else 0
+        return T/2, ratio, idx, zh
+
+    proposals = {0: propose(0)}
+    gains = []
+    while len(gains) + 1 < k:
+        valid = [l for l in proposals if proposals[l] is not None and
+                 proposals[l][1] >= min_gain]
+        if not valid:
+            break
+        l = max(valid, key=lambda l: proposals[l][0])
+        gain, ratio, idx, zh = proposals[l]
+        new = len(gains) + 1
+        z[idx[zh == 1]] = new
+        gains.append(gain)
+        proposals[l] = propose(l)
+        proposals[new] = propose(new)
+    return z, np.array(gains)
 
 def plot(X, z, fname='plot.pdf'):
     n = len(X[0])